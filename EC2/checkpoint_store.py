@@ -0,0 +1,92 @@
+import asyncio
+import os
+import re
+
+from quart import Blueprint, Response, abort, current_app, request
+
+import protocol
+from conf import settings
+
+# the ids become file names, so keep them plain
+_CHECKPOINT_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+class CheckpointStore:
+    """The checkpoints of the restarted workers on the local filesystem
+
+    It stands in for an object store, so the weights do not travel through the
+    Lambda responses and payloads, whose sizes are limited. A checkpoint is kept as
+    the binary frame uploaded by the worker (see `cloud_train.checkpoint`).
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, checkpoint_id: str) -> str:
+        return os.path.join(self.root, checkpoint_id + ".ckpt")
+
+    def write(self, checkpoint_id: str, data: bytes) -> None:
+        path = self.path(checkpoint_id)
+        # a reader never sees a partially written checkpoint
+        tmp_path = "{}.{:d}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read(self, checkpoint_id: str) -> bytes | None:
+        try:
+            with open(self.path(checkpoint_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, checkpoint_id: str) -> bool:
+        try:
+            os.remove(self.path(checkpoint_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+
+store = CheckpointStore(settings.CHECKPOINT_DIR)
+checkpoints = Blueprint("checkpoints", __name__, url_prefix="/checkpoints")
+
+
+def valid_id(checkpoint_id: str) -> str:
+    if _CHECKPOINT_ID.match(checkpoint_id) is None:
+        abort(400, "Invalid checkpoint id: " + checkpoint_id)
+    return checkpoint_id
+
+
+@checkpoints.put("/<checkpoint_id>")
+async def put_checkpoint(checkpoint_id: str):
+    checkpoint_id = valid_id(checkpoint_id)
+    data = await request.get_data()
+    if not protocol.is_frame(data):
+        return {"error": "The checkpoint is not a binary frame"}, 400
+    # the file system is blocking, keep it off the event loop
+    await asyncio.to_thread(store.write, checkpoint_id, data)
+    current_app.logger.info("Save checkpoint %s: %d bytes", checkpoint_id, len(data))
+    return {"checkpoint-id": checkpoint_id}
+
+
+@checkpoints.get("/<checkpoint_id>")
+async def get_checkpoint(checkpoint_id: str):
+    checkpoint_id = valid_id(checkpoint_id)
+    data = await asyncio.to_thread(store.read, checkpoint_id)
+    if data is None:
+        abort(404, "Unknown checkpoint: " + checkpoint_id)
+    return Response(
+        [data],
+        mimetype=protocol.CONTENT_TYPE,
+        headers={"Content-Length": str(len(data))},
+    )
+
+
+@checkpoints.delete("/<checkpoint_id>")
+async def delete_checkpoint(checkpoint_id: str):
+    checkpoint_id = valid_id(checkpoint_id)
+    if not await asyncio.to_thread(store.delete, checkpoint_id):
+        abort(404, "Unknown checkpoint: " + checkpoint_id)
+    return {"checkpoint-id": checkpoint_id}
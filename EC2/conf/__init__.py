@@ -11,6 +11,20 @@ class Settings:
     BATCH_SIZE: int
     MOMENTUM: float
     LEARNING_RATE: float
+    MODEL_NAME: str | None
+    TOPK_RATIO: float | None
+    SPARSE_REPLY: bool
+    QUANT: str
+    STOCHASTIC_ROUNDING: bool
+    SHARD_NUMBER: int
+    TRIAL_ID: str | None
+    SYNC_MODE: str
+    SYNC_PERIOD: int
+    SYNC_OVERHEAD: float | None
+    CHECKPOINT_DIR: str
+    BACKUP_WORKERS: int
+    ROUND_DEADLINE: float | None
+    LATE_POLICY: str
 
     def __init__(self, settings):
         for attr in dir(settings):
@@ -10,6 +10,41 @@ OUTPUT_FILE = "log/result.txt"
 BATCH_SIZE = 128
 MOMENTUM = 0.9
 LEARNING_RATE = 0.1
+# the model trained by the workers, None to use the MODEL_NAME of the function
+MODEL_NAME = None
+# the ratio of gradient entries sent by the workers, None to disable top-k
+TOPK_RATIO = None
+# whether the parameter server replies with top-k entries as well
+SPARSE_REPLY = False
+# the quantization of the exchanged gradients: "fp32" | "fp16" | "int8"
+QUANT = "fp32"
+# whether to use stochastic rounding for "int8"
+STOCHASTIC_ROUNDING = False
+# the number of parameter server processes, listening on PORT, PORT + 1, ...
+SHARD_NUMBER = 1
+# the trial on a long-lived parameter server (see `server.create_trial`),
+# None to use a dedicated parameter server
+TRIAL_ID = None
+# when the workers synchronize: "epoch" | "grad" | "local-sgd" (see
+# `cloud_train.SyncSetting`), every SYNC_PERIOD steps for the latter two
+SYNC_MODE = "epoch"
+SYNC_PERIOD = 1
+# the target fraction of the time spent on synchronization, to adapt SYNC_PERIOD,
+# None to keep it fixed
+SYNC_OVERHEAD = None
+# the workers a round of the parameter server does not wait for, i.e. a round
+# finishes once WORKER_NUMBER - BACKUP_WORKERS workers push; not supported with
+# SHARD_NUMBER > 1, nor is ROUND_DEADLINE
+BACKUP_WORKERS = 0
+# the seconds after the first push of a round to finish it anyway, None to wait
+ROUND_DEADLINE = None
+# the grads pushed after their round finishes: "drop" | "next" (folded into the
+# current round)
+LATE_POLICY = "drop"
+# where the parameter server keeps the checkpoints of the restarted workers
+CHECKPOINT_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checkpoints"
+)
 
 if os.environ.get("EC2_PROXY_USE_CLI") == "1":
     parser = argparse.ArgumentParser()
@@ -22,6 +57,29 @@ if os.environ.get("EC2_PROXY_USE_CLI") == "1":
     parser.add_argument("--batch-size", type=int, required=True)
     parser.add_argument("--momentum", type=float, required=True)
     parser.add_argument("--learning-rate", type=float, required=True)
+    parser.add_argument("--model-name", type=str, default=MODEL_NAME)
+    parser.add_argument("--topk-ratio", type=float, default=TOPK_RATIO)
+    parser.add_argument("--sparse-reply", action="store_true")
+    parser.add_argument(
+        "--quant", type=str, choices=["fp32", "fp16", "int8"], default=QUANT
+    )
+    parser.add_argument("--stochastic-rounding", action="store_true")
+    parser.add_argument("--shard-number", type=int, default=SHARD_NUMBER)
+    parser.add_argument("--trial-id", type=str, default=TRIAL_ID)
+    parser.add_argument(
+        "--sync-mode",
+        type=str,
+        choices=["epoch", "grad", "local-sgd"],
+        default=SYNC_MODE,
+    )
+    parser.add_argument("--sync-period", type=int, default=SYNC_PERIOD)
+    parser.add_argument("--sync-overhead", type=float, default=SYNC_OVERHEAD)
+    parser.add_argument("--checkpoint-dir", type=str, default=CHECKPOINT_DIR)
+    parser.add_argument("--backup-workers", type=int, default=BACKUP_WORKERS)
+    parser.add_argument("--round-deadline", type=float, default=ROUND_DEADLINE)
+    parser.add_argument(
+        "--late-policy", type=str, choices=["drop", "next"], default=LATE_POLICY
+    )
     args = parser.parse_args()
 
     WORKER_NUMBER = args.worker_number
@@ -33,3 +91,17 @@ if os.environ.get("EC2_PROXY_USE_CLI") == "1":
     BATCH_SIZE = args.batch_size
     MOMENTUM = args.momentum
     LEARNING_RATE = args.learning_rate
+    MODEL_NAME = args.model_name
+    TOPK_RATIO = args.topk_ratio
+    SPARSE_REPLY = args.sparse_reply
+    QUANT = args.quant
+    STOCHASTIC_ROUNDING = args.stochastic_rounding
+    SHARD_NUMBER = args.shard_number
+    TRIAL_ID = args.trial_id
+    SYNC_MODE = args.sync_mode
+    SYNC_PERIOD = args.sync_period
+    SYNC_OVERHEAD = args.sync_overhead
+    CHECKPOINT_DIR = args.checkpoint_dir
+    BACKUP_WORKERS = args.backup_workers
+    ROUND_DEADLINE = args.round_deadline
+    LATE_POLICY = args.late_policy
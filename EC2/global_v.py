@@ -1,23 +1,134 @@
-from threading import Condition, Lock
-from typing import Any
+import asyncio
+from typing import Literal
 
-from numpy import ndarray
-from pydantic import BaseModel, ConfigDict, NonNegativeInt
+from pydantic import BaseModel, ConfigDict, Field, NonNegativeInt, PositiveInt
+
+from grad_buffer import GradBuffer
+from protocol import TopKCompressor
+from sync_period import SyncPeriodEstimator
+
+
+class SyncRound(BaseModel):
+    """A round of the synchronization, which is a barrier awaited by the workers"""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    number: NonNegativeInt
+    # the pushes of the round, on time
+    receive_number: NonNegativeInt = 0
+    # the late pushes of the previous rounds folded into the round
+    folded_number: NonNegativeInt = 0
+    # the accumulation buffer, bound at the first receive of the round
+    buffer: GradBuffer | None = None
+    # the averaged grads, encoded lazily for each wire format
+    new_grads_hex: str | None = None
+    new_grads_frames: dict[str, bytes] = Field(default_factory=dict)
+    # the slowest computation reported by the workers, and its number of steps
+    compute_time: float = 0.0
+    sync_steps: NonNegativeInt = 0
+    # the target synchronization overhead, if the workers ask for a period
+    overhead: float | None = None
+    # the period recommended to the workers once the round finishes
+    sync_period: PositiveInt | None = None
+    # set when the trial is torn down before the round finishes
+    aborted: bool = False
+    done: asyncio.Event = Field(default_factory=asyncio.Event)
+    # closes the round at the deadline, started by the first push
+    deadline: asyncio.TimerHandle | None = None
+    # the loop time when the round finishes, to measure the late pushes
+    closed_at: float | None = None
+
+    async def wait(self) -> None:
+        await self.done.wait()
+
+
+class WorkerLateness(BaseModel):
+    """The lateness of the pushes of a worker"""
+
+    on_time: NonNegativeInt = 0
+    late: NonNegativeInt = 0
+    # the time from the end of the round to the late pushes, in seconds
+    total_lateness: float = 0.0
+    max_lateness: float = 0.0
+
+    def record_late(self, lateness: float) -> None:
+        self.late += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
 
 
 class SyncGrad(BaseModel):
+    """The synchronization state of a trial
+
+    A round finishes once `quorum` workers push, or at `round_deadline` after its
+    first push, whichever comes first, and averages whatever arrived. The workers
+    identified by `protocol.WORKER_ID_HEADER` push once a round, so a push of a
+    round that is already finished is late: it is replied with the result of its
+    round, and its grads are dropped or folded into the current round, by
+    `late_policy`.
+
+    The shards of a sharded parameter server close their rounds on their own, so
+    a worker could be on time for some layers and late for others, and it does
+    not read `protocol.SYNC_LATE_HEADER`. A trial of the sharded parameter server
+    therefore waits for every worker.
+    """
+
     model_config = ConfigDict(arbitrary_types_allowed=True)
-    receive_number: NonNegativeInt
-    send_number: NonNegativeInt
-    grads: list[ndarray] | None
-    new_grads_hex: str | None
-    cv: Condition
-
-
-shared = SyncGrad(
-    receive_number=0,
-    send_number=0,
-    grads=None,
-    new_grads_hex=None,
-    cv=Condition(),
-)
+    worker_number: PositiveInt
+    quorum: PositiveInt
+    # in seconds, None to wait for the quorum
+    round_deadline: float | None = Field(default=None, gt=0)
+    late_policy: Literal["drop", "next"] = "drop"
+    round: SyncRound
+    # the last finished round, replied to its late pushes
+    previous_round: SyncRound | None = None
+    # the round of the next push of each worker, by worker id
+    worker_rounds: dict[str, int] = Field(default_factory=dict)
+    lateness: dict[str, WorkerLateness] = Field(default_factory=dict)
+    # the accumulation buffers, used alternately by the rounds
+    buffers: list[GradBuffer | None]
+    # error feedback of the sparse replies, by top-k ratio
+    reply_compressors: dict[float, TopKCompressor]
+    period_estimator: SyncPeriodEstimator
+
+    def next_round(self) -> None:
+        # the workers of the finished round keep their reference to it
+        self.previous_round = self.round
+        self.round = SyncRound(number=self.round.number + 1)
+
+    def abort(self) -> None:
+        if self.round.deadline is not None:
+            self.round.deadline.cancel()
+        self.round.aborted = True
+        self.round.done.set()
+
+
+def new_trial(
+    worker_number: int,
+    backup_workers: int = 0,
+    round_deadline: float | None = None,
+    late_policy: str = "drop",
+) -> SyncGrad:
+    """
+    args:
+        backup_workers: the workers a round does not wait for
+    """
+    if not 0 <= backup_workers < worker_number:
+        raise ValueError(
+            "The backup workers should be in [0, {}): {}".format(
+                worker_number, backup_workers
+            )
+        )
+    return SyncGrad(
+        worker_number=worker_number,
+        quorum=worker_number - backup_workers,
+        round_deadline=round_deadline,
+        late_policy=late_policy,  # type: ignore
+        round=SyncRound(number=0),
+        buffers=[None, None],
+        reply_compressors=dict(),
+        period_estimator=SyncPeriodEstimator(),
+    )
+
+
+# all the trials hosted by the parameter server, by trial id
+trials: dict[str, SyncGrad] = dict()
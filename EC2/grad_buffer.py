@@ -0,0 +1,66 @@
+import numpy as np
+
+import protocol
+
+Payload = bytes | list[protocol.Grad | None]
+
+
+def layer_shapes(payload: Payload) -> list[tuple[int, ...] | None]:
+    """The shape of each layer of a binary frame, or of a list of grads"""
+    if isinstance(payload, bytes):
+        header, _ = protocol.decode_header(payload)
+        return [
+            None if layer is None else tuple(layer["shape"])
+            for layer in header["layers"]
+        ]
+    return [None if grad is None else tuple(grad.shape) for grad in payload]
+
+
+class GradBuffer:
+    """A preallocated float32 buffer to average the grads of a round
+
+    The buffer is a dense binary frame itself (see `protocol.allocate_frame`), so
+    an incoming dense float32 frame of the same layout is accumulated with a
+    single `np.add` over its data section, and the averaged grads are replied
+    without any serialization.
+    """
+
+    def __init__(self, shapes: list[tuple[int, ...] | None]) -> None:
+        self.shapes = shapes
+        self.frame, self.flat, self.views = protocol.allocate_frame(shapes)
+        self.header = bytes(self.frame[: len(self.frame) - self.flat.nbytes])
+
+    def fits(self, payload: Payload) -> bool:
+        if isinstance(payload, bytes) and self._same_layout(payload):
+            return True
+        return layer_shapes(payload) == self.shapes
+
+    def _same_layout(self, frame: bytes) -> bool:
+        # the header is deterministic, so the same header means the same layout
+        return len(frame) == len(self.frame) and frame.startswith(self.header)
+
+    def clear(self) -> None:
+        self.flat.fill(0)
+
+    def add(self, payload: Payload) -> None:
+        if isinstance(payload, bytes):
+            if self._same_layout(payload):
+                incoming = np.frombuffer(
+                    payload,
+                    dtype=self.flat.dtype,
+                    count=self.flat.size,
+                    offset=len(self.header),
+                )
+                np.add(self.flat, incoming, out=self.flat)
+                return
+            payload = protocol.decode_frame(payload)
+        for view, grad in zip(self.views, payload):
+            if view is None or grad is None:
+                continue
+            if isinstance(grad, protocol.SparseGrad):
+                grad.add_to(view)
+            else:
+                np.add(view, grad, out=view)
+
+    def average(self, n: int) -> None:
+        self.flat /= n
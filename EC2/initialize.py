@@ -1,4 +1,5 @@
 import json
+import math
 import os
 import signal
 import threading
@@ -48,6 +49,51 @@ def validate_invoke() -> bool:
     return True
 
 
+def ps_path() -> str:
+    """The path of the synchronization endpoint of the trial"""
+    if settings.TRIAL_ID is None:
+        return "/ps"
+    return f"/trials/{settings.TRIAL_ID}/ps"
+
+
+def create_trial() -> None:
+    """Create the trial on every shard of the long-lived parameter server"""
+    for shard in range(settings.SHARD_NUMBER):
+        res = requests.post(
+            f"http://127.0.0.1:{settings.PORT + shard}/trials",
+            json={
+                "trial-id": settings.TRIAL_ID,
+                "worker-number": settings.WORKER_NUMBER,
+                "backup-workers": settings.BACKUP_WORKERS,
+                "round-deadline": settings.ROUND_DEADLINE,
+                "late-policy": settings.LATE_POLICY,
+            },
+            timeout=10,
+        )
+        res.raise_for_status()
+    logger.info("Trial %s created", settings.TRIAL_ID)
+
+
+def delete_trial() -> None:
+    for shard in range(settings.SHARD_NUMBER):
+        res = requests.delete(
+            f"http://127.0.0.1:{settings.PORT + shard}/trials/{settings.TRIAL_ID}",
+            timeout=10,
+        )
+        if res.status_code != 200:
+            logger.warning("Fail to delete trial %s: %s", settings.TRIAL_ID, res.text)
+
+
+def delete_checkpoint(checkpoint_id: str) -> None:
+    try:
+        requests.delete(
+            f"http://127.0.0.1:{settings.PORT}/checkpoints/{checkpoint_id}",
+            timeout=10,
+        )
+    except requests.RequestException as e:
+        logger.warning("Fail to delete checkpoint %s: %s", checkpoint_id, e)
+
+
 def add_time(_time: float):
     with lambda_total_time_mtx:
         lambda_total_time.append(_time)
@@ -57,36 +103,54 @@ def invoke_lambda(index: int, payload: dict[str, Any]):
     # validate the Lambda function exists
 
     test_res = "0"
-    while True:
-        logger.debug(
-            "Invoke %d-th worker with %s", index, response_for_logging(payload)
-        )
-        boto3_response = lambda_client.invoke(
-            FunctionName=settings.FUNCTION_NAME,
-            Payload=json.dumps(payload).encode("utf-8"),
-        )
-        response = json.loads(boto3_response["Payload"].read())
-        logger.debug(
-            "The %d-th worker response with %s", index, response_for_logging(response)
-        )
-        add_time(TOTAL_TIME_LIMIT - float(response["leftTime"]))
-
-        if response["error"]:
-            logger.error(
-                "The %d-th worker fails: %s",
+    try:
+        while True:
+            logger.debug(
+                "Invoke %d-th worker with %s", index, response_for_logging(payload)
+            )
+            boto3_response = lambda_client.invoke(
+                FunctionName=settings.FUNCTION_NAME,
+                Payload=json.dumps(payload).encode("utf-8"),
+            )
+            response = json.loads(boto3_response["Payload"].read())
+            logger.debug(
+                "The %d-th worker response with %s",
                 index,
-                response["errorMessage"],
+                response_for_logging(response),
             )
-            # os.kill(os.getpid(), signal.SIGUSR1)
-            break
-        if not response["restart"]:
-            logger.info("The %d-th worker finishes", index)
-            test_res = response.get("test_accuracy", "0")
-            break
-        payload["begin-epoch"] = response["epoch"]
-        if (weight_hex := response.get("weight_hex")) is not None:
-            payload["weight_hex"] = weight_hex
-        logger.info("The %d-th worker restarts from epoch %d", index, response["epoch"])
+            add_time(TOTAL_TIME_LIMIT - float(response["leftTime"]))
+
+            if response["error"]:
+                logger.error(
+                    "The %d-th worker fails: %s",
+                    index,
+                    response["errorMessage"],
+                )
+                # os.kill(os.getpid(), signal.SIGUSR1)
+                break
+            if not response["restart"]:
+                logger.info("The %d-th worker finishes", index)
+                test_res = response.get("test_accuracy", "0")
+                break
+            payload["begin-epoch"] = response["epoch"]
+            payload["begin-step"] = response.get("step", 0)
+            if (sync_period := response.get("sync_period")) is not None:
+                payload["sync-period"] = sync_period
+            payload["next-sync-period"] = response.get("next_sync_period")
+            if (checkpoint_id := response.get("checkpoint_id")) is not None:
+                payload["checkpoint-id"] = checkpoint_id
+            elif (weight_hex := response.get("weight_hex")) is not None:
+                payload["weight_hex"] = weight_hex
+            logger.info(
+                "The %d-th worker restarts from epoch %d, step %d",
+                index,
+                response["epoch"],
+                payload["begin-step"],
+            )
+    finally:
+        # also when an invocation raises, or the checkpoint is left on the disk
+        if (checkpoint_id := payload.get("checkpoint-id")) is not None:
+            delete_checkpoint(checkpoint_id)
     test_results.append(test_res)
 
 
@@ -107,7 +171,8 @@ def create_worker(worker_number: int) -> list[threading.Thread]:
         slice_begin = i * settings.DATA_SIZE // worker_number
         slice_end = (i + 1) * settings.DATA_SIZE // worker_number
         payload = {
-            "proxy-url": f"http://{instance_ip}:{settings.PORT}/ps",
+            "proxy-url": f"http://{instance_ip}:{settings.PORT}{ps_path()}",
+            "checkpoint-url": f"http://{instance_ip}:{settings.PORT}/checkpoints",
             "slice-begin": slice_begin,
             "slice-end": slice_end,
             "epoch": settings.EPOCH,
@@ -116,7 +181,30 @@ def create_worker(worker_number: int) -> list[threading.Thread]:
             "momentum": settings.MOMENTUM,
             # 0-indexed
             "begin-epoch": 0,
+            "worker-id": i,
         }
+        if settings.MODEL_NAME is not None:
+            payload["model-name"] = settings.MODEL_NAME
+        if settings.TOPK_RATIO is not None:
+            payload["topk-ratio"] = settings.TOPK_RATIO
+            payload["sparse-reply"] = settings.SPARSE_REPLY
+        if settings.QUANT != "fp32":
+            payload["quant"] = settings.QUANT
+            payload["stochastic-rounding"] = settings.STOCHASTIC_ROUNDING
+        if settings.SHARD_NUMBER > 1:
+            payload["shard-urls"] = [
+                f"http://{instance_ip}:{settings.PORT + shard}{ps_path()}"
+                for shard in range(settings.SHARD_NUMBER)
+            ]
+        if settings.SYNC_MODE != "epoch":
+            payload["sync-mode"] = settings.SYNC_MODE
+            payload["sync-period"] = settings.SYNC_PERIOD
+            # the smallest slice bounds the steps that every worker has
+            payload["epoch-steps"] = math.ceil(
+                settings.DATA_SIZE // worker_number / settings.BATCH_SIZE
+            )
+            if settings.SYNC_OVERHEAD is not None:
+                payload["sync-overhead"] = settings.SYNC_OVERHEAD
         thread_list.append(threading.Thread(target=invoke_lambda, args=(i, payload)))
 
     return thread_list
@@ -4,7 +4,13 @@ import os
 import signal
 
 from conf import settings
-from initialize import create_worker, test_results, lambda_total_time
+from initialize import (
+    create_trial,
+    create_worker,
+    delete_trial,
+    lambda_total_time,
+    test_results,
+)
 from utils import get_logger
 
 logger = get_logger(__name__)
@@ -21,12 +27,16 @@ if __name__ == "__main__":
 
     logging.getLogger("initialize").setLevel(logging.DEBUG)
     logger.setLevel(logging.DEBUG)
+    if settings.TRIAL_ID is not None:
+        create_trial()
     thread_list = create_worker(settings.WORKER_NUMBER)
     for thread in thread_list:
         thread.start()
 
     for thread in thread_list:
         thread.join()
+    if settings.TRIAL_ID is not None:
+        delete_trial()
 
     logger.info("Test accuracy: %s; Total time: %s", test_results, lambda_total_time)
 
@@ -1,72 +1,363 @@
+import asyncio
 import logging
+import multiprocessing
 import pickle
-import threading
+import uuid
 
-import numpy as np
-from flask import Flask, request
+from hypercorn.asyncio import serve
+from hypercorn.config import Config
+from quart import Quart, Response, abort, request
 
+import protocol
+from checkpoint_store import checkpoints
 from conf import settings
-from global_v import shared
+from global_v import SyncGrad, SyncRound, WorkerLateness, new_trial, trials
+from grad_buffer import GradBuffer, Payload, layer_shapes
 
-app = Flask(__name__)
+app = Quart(__name__)
+# a ResNet18 frame is far beyond the default limit
+app.config["MAX_CONTENT_LENGTH"] = None
+app.config["RESPONSE_TIMEOUT"] = None
+# the checkpoints of the restarted workers, see `checkpoint_store`
+app.register_blueprint(checkpoints)
 
-WORKER_NUMBER = settings.WORKER_NUMBER
+# the pending connections are cheap coroutines, allow a lot of them
+BACKLOG = 4096
+# the workers keep their connections across the synchronizations, which can be
+# as far apart as a Lambda lifetime
+KEEP_ALIVE_TIMEOUT = 900
 
-# suppress WSGI logging
-# flask_wsgi_logger = logging.getLogger("werkzeug")
-# flask_wsgi_logger.setLevel(logging.ERROR)
+# the trial served by the legacy endpoints (/ps and /check)
+DEFAULT_TRIAL = "default"
 
 
-def after_all_response():
-    with shared.cv:
-        shared.send_number += 1
-        if shared.send_number != WORKER_NUMBER:
-            shared.cv.wait()
-        else:
-            app.logger.debug("All responses sent, now clean the data")
-            shared.grads, shared.new_grads_hex = None, None
-            shared.receive_number, shared.send_number = 0, 0
-            shared.cv.notify_all()
+def check_quorum(trial: SyncGrad) -> None:
+    """A trial of the sharded parameter server waits for every worker, see
+    `SyncGrad`
+    """
+    if settings.SHARD_NUMBER > 1 and (
+        trial.quorum < trial.worker_number or trial.round_deadline is not None
+    ):
+        raise ValueError("The quorum is not supported by the sharded parameter server")
 
 
-@app.post("/ps")
-def sync_grads():
-    grads_hex: str = request.json["grads"]  # type: ignore
+trials[DEFAULT_TRIAL] = new_trial(
+    settings.WORKER_NUMBER,
+    settings.BACKUP_WORKERS,
+    settings.ROUND_DEADLINE,
+    settings.LATE_POLICY,
+)
+check_quorum(trials[DEFAULT_TRIAL])
+
+# suppress ASGI logging
+# asgi_logger = logging.getLogger("hypercorn.access")
+# asgi_logger.setLevel(logging.ERROR)
+
+
+async def receive_grads() -> tuple[Payload, bool]:
+    """Read the grads from the request
+    The binary frame (see `protocol`) is preferred, while the legacy format,
+    i.e. pickle-then-hex inside JSON, is still accepted.
+    returns:
+        the frame as is or the decoded legacy grads, and whether the request uses
+        the binary frame
+    """
+    if request.mimetype == protocol.CONTENT_TYPE:
+        frame = await request.get_data()
+        app.logger.debug("Receive request, grads: {:d} bytes".format(len(frame)))
+        return frame, True  # type: ignore
+
+    grads_hex: str = (await request.get_json())["grads"]
     app.logger.debug("Receive request, grads: {:d} bytes".format(len(grads_hex)))
-    grads: list[np.ndarray] = pickle.loads(bytes.fromhex(grads_hex))  # type: ignore
-    with shared.cv:
-        if shared.grads is None:
-            shared.grads = grads
-        else:
-            for i in range(len(grads)):
-                shared.grads[i] += grads[i]
-        shared.receive_number += 1
-        if shared.receive_number != WORKER_NUMBER:
-            shared.cv.wait_for(lambda: shared.receive_number == WORKER_NUMBER)
+    return pickle.loads(bytes.fromhex(grads_hex)), False
+
+
+def get_trial(trial_id: str) -> SyncGrad:
+    if (trial := trials.get(trial_id)) is None:
+        abort(404, "Unknown trial: " + trial_id)
+    return trial
+
+
+def current_buffer(
+    trial: SyncGrad, sync_round: SyncRound, payload: Payload
+) -> GradBuffer | None:
+    """The buffer of a round, bound at its first receive
+    The buffer is allocated at the first round and reused afterwards. Two buffers
+    are used alternately, since the replies of a round may still be sent while
+    the next round is accumulating.
+    returns:
+        None if the layout of the payload conflicts with the round
+    """
+    if sync_round.buffer is not None:
+        return sync_round.buffer if sync_round.buffer.fits(payload) else None
+    index = sync_round.number % len(trial.buffers)
+    buffer = trial.buffers[index]
+    if buffer is not None and buffer.fits(payload):
+        buffer.clear()
+    else:
+        app.logger.info("Allocate the grads buffer %d", index)
+        buffer = trial.buffers[index] = GradBuffer(layer_shapes(payload))
+    sync_round.buffer = buffer
+    return buffer
+
+
+def record_computation(sync_round: SyncRound) -> None:
+    """Record the computation reported by a worker, see `SyncPeriodEstimator`"""
+    compute_time = request.headers.get(protocol.COMPUTE_TIME_HEADER, type=float)
+    if compute_time is None or compute_time < sync_round.compute_time:
+        return
+    sync_round.compute_time = compute_time
+    sync_round.sync_steps = request.headers.get(protocol.SYNC_STEPS_HEADER, 0, type=int)
+    sync_round.overhead = request.headers.get(protocol.SYNC_OVERHEAD_HEADER, type=float)
+
+
+def close_round(trial: SyncGrad, sync_round: SyncRound) -> None:
+    """Finish a round with the pushes so far, at the quorum or the deadline"""
+    if sync_round is not trial.round or sync_round.done.is_set():
+        return
+    if sync_round.deadline is not None:
+        sync_round.deadline.cancel()
+    buffer: GradBuffer = sync_round.buffer  # type: ignore
+    buffer.average(sync_round.receive_number + sync_round.folded_number)
+    if sync_round.overhead is not None:
+        sync_round.sync_period = trial.period_estimator.update(
+            sync_round.compute_time, sync_round.sync_steps, sync_round.overhead
+        )
+    sync_round.closed_at = asyncio.get_running_loop().time()
+    sync_round.done.set()
+    if sync_round.receive_number < trial.worker_number:
+        app.logger.info(
+            "Round %d finished with %d/%d workers",
+            sync_round.number,
+            sync_round.receive_number,
+            trial.worker_number,
+        )
+    trial.next_round()
+
+
+def receive_late(trial: SyncGrad, worker_id: str, payload: Payload) -> SyncRound | None:
+    """Tell the round of a push of an identified worker
+    A late push is recorded in the lateness of the worker, and its grads are
+    folded into the current round if the late policy is "next".
+    returns:
+        the finished round that the push is late for, None if the push counts in
+        the current round, including a push too late to be replied with its round,
+        whose worker rejoins the current round
+    """
+    sync_round = trial.round
+    lateness = trial.lateness.setdefault(worker_id, WorkerLateness())
+    # every worker begins at the first round, and a restarted one goes on with
+    # the rounds of its worker id
+    push_round = trial.worker_rounds.get(worker_id, 0)
+    if push_round >= sync_round.number:
+        lateness.on_time += 1
+        trial.worker_rounds[worker_id] = sync_round.number + 1
+        return None
+
+    previous_round: SyncRound = trial.previous_round  # type: ignore
+    lateness.record_late(
+        asyncio.get_running_loop().time() - previous_round.closed_at  # type: ignore
+    )
+    if push_round != previous_round.number:
+        trial.worker_rounds[worker_id] = sync_round.number + 1
+        return None
+    trial.worker_rounds[worker_id] = push_round + 1
+    if trial.late_policy == "next" and (
+        buffer := current_buffer(trial, sync_round, payload)
+    ):
+        buffer.add(payload)
+        sync_round.folded_number += 1
+    return previous_round
+
+
+def encode_new_grads(
+    trial: SyncGrad,
+    sync_round: SyncRound,
+    binary: bool,
+    reply_topk_ratio: float | None,
+    reply_quant: str,
+    reply_stochastic: bool = False,
+) -> bytes | bytearray | str:
+    """Encode the averaged grads, only once per round for each format"""
+    buffer: GradBuffer = sync_round.buffer  # type: ignore
+    if not binary:
+        if sync_round.new_grads_hex is None:
+            sync_round.new_grads_hex = pickle.dumps(buffer.views).hex()
+        return sync_round.new_grads_hex
+
+    if reply_topk_ratio is None and reply_quant == "fp32":
+        # the buffer is a frame already
+        return buffer.frame
+
+    reply_format = "{}:{}{}".format(
+        "dense" if reply_topk_ratio is None else f"topk-{reply_topk_ratio}",
+        reply_quant,
+        ":stochastic" if reply_stochastic else "",
+    )
+    if (frame := sync_round.new_grads_frames.get(reply_format)) is not None:
+        return frame
+    grads: list[protocol.Grad | None] = buffer.views  # type: ignore
+    if reply_topk_ratio is not None:
+        # the entries not sent are fed back into the reply of the next round
+        compressor = trial.reply_compressors.setdefault(
+            reply_topk_ratio, protocol.TopKCompressor(reply_topk_ratio)
+        )
+        grads = compressor.compress(buffer.views)
+    # the grads are accumulated in float32, and requantized only for the reply
+    frame = protocol.encode_grads(
+        grads, protocol.Quantizer(reply_quant, stochastic=reply_stochastic)
+    )
+    sync_round.new_grads_frames[reply_format] = frame
+    return frame
+
+
+@app.post("/ps")
+async def sync_grads():
+    return await sync_trial_grads(DEFAULT_TRIAL)
+
+
+@app.post("/trials/<trial_id>/ps")
+async def sync_trial_grads(trial_id: str):
+    trial = get_trial(trial_id)
+    payload, binary = await receive_grads()
+    reply_topk_ratio = request.headers.get(protocol.REPLY_TOPK_HEADER, type=float)
+    reply_quant = request.headers.get(protocol.REPLY_QUANT_HEADER, "fp32")
+    if reply_quant not in protocol.QUANT_METHODS:
+        return {"error": "Unknown quantization method: " + reply_quant}, 400
+    reply_stochastic = request.headers.get(protocol.REPLY_STOCHASTIC_HEADER) == "1"
+
+    # There is no await between reading the round and counting the receive, so
+    # the coroutines of the same round never interleave here.
+    late_round = None
+    if (worker_id := request.headers.get(protocol.WORKER_ID_HEADER)) is not None:
+        late_round = receive_late(trial, worker_id, payload)
+    if late_round is not None:
+        sync_round = late_round
+    else:
+        sync_round = trial.round
+        if (buffer := current_buffer(trial, sync_round, payload)) is None:
+            return {"error": "The grads do not match the layout of the round"}, 400
+        buffer.add(payload)
+        record_computation(sync_round)
+        sync_round.receive_number += 1
+        if sync_round.receive_number == 1 and trial.round_deadline is not None:
+            sync_round.deadline = asyncio.get_running_loop().call_later(
+                trial.round_deadline, close_round, trial, sync_round
+            )
+        if sync_round.receive_number >= trial.quorum:
+            close_round(trial, sync_round)
+            app.logger.debug("Trial %s: round %d finished", trial_id, sync_round.number)
         else:
-            for grad in shared.grads:
-                grad /= WORKER_NUMBER
-            assert shared.new_grads_hex is None, "new_grads_hex should be None"
-            shared.new_grads_hex = pickle.dumps(shared.grads).hex()
-            shared.cv.notify_all()
-
-    app.logger.debug(
-        "Return grads with size {:d} bytes".format(len(shared.new_grads_hex))
+            await sync_round.wait()
+            if sync_round.aborted:
+                return {"error": "The trial is torn down: " + trial_id}, 410
+    new_grads = encode_new_grads(
+        trial, sync_round, binary, reply_topk_ratio, reply_quant, reply_stochastic
     )
-    # clear
-    new_grads_hex = shared.new_grads_hex
-    thr = threading.Thread(target=after_all_response)
-    thr.start()
+
+    app.logger.debug("Return grads with size {:d} bytes".format(len(new_grads)))
+    headers = dict()
+    if late_round is not None:
+        headers[protocol.SYNC_LATE_HEADER] = "1"
+    if sync_round.sync_period is not None:
+        headers[protocol.SYNC_PERIOD_HEADER] = str(sync_round.sync_period)
+    if binary:
+        # pass the frame as a body chunk, so that the buffer is not copied
+        headers["Content-Length"] = str(len(new_grads))
+        return Response([new_grads], mimetype=protocol.CONTENT_TYPE, headers=headers)
     return {
-        "new-grads": new_grads_hex,
-    }
+        "new-grads": new_grads,
+    }, headers
 
 
 @app.get("/check")
-def check_variable():
-    app.logger.debug("Checked: {}".format(shared))
-    return {"syncGrad": shared.__repr__()}
+async def check_variable():
+    return await check_trial(DEFAULT_TRIAL)
+
+
+@app.get("/trials/<trial_id>/check")
+async def check_trial(trial_id: str):
+    trial = get_trial(trial_id)
+    app.logger.debug("Checked: {}".format(trial))
+    return {"syncGrad": trial.__repr__()}
+
+
+@app.get("/trials/<trial_id>/lateness")
+async def trial_lateness(trial_id: str):
+    """The lateness of the pushes of each worker of the trial, see `SyncGrad`"""
+    trial = get_trial(trial_id)
+    return {
+        worker_id: lateness.model_dump()
+        for worker_id, lateness in trial.lateness.items()
+    }
+
+
+@app.get("/trials")
+async def list_trials():
+    return {
+        trial_id: {"worker-number": trial.worker_number, "round": trial.round.number}
+        for trial_id, trial in trials.items()
+    }
+
+
+@app.post("/trials")
+async def create_trial():
+    """Create a trial
+    The JSON body contains "worker-number", and optionally "trial-id" (a random
+    one is generated if absent), and the quorum of the rounds (see `SyncGrad`):
+    "backup-workers" (0 by default), "round-deadline" in seconds and
+    "late-policy" ("drop" by default).
+    """
+    body = await request.get_json()
+    try:
+        worker_number = int(body["worker-number"])
+        trial = new_trial(
+            worker_number,
+            int(body.get("backup-workers", 0)),
+            body.get("round-deadline"),
+            body.get("late-policy", "drop"),
+        )
+        check_quorum(trial)
+    except (KeyError, TypeError, ValueError) as e:
+        return {"error": "Invalid trial: {}".format(e)}, 400
+    trial_id = str(body.get("trial-id") or uuid.uuid4().hex)
+    if trial_id in trials:
+        return {"error": "The trial exists: " + trial_id}, 409
+    trials[trial_id] = trial
+    app.logger.info("Create trial %s with %d workers", trial_id, worker_number)
+    return {"trial-id": trial_id}, 201
+
+
+@app.delete("/trials/<trial_id>")
+async def delete_trial(trial_id: str):
+    trial = get_trial(trial_id)
+    # the workers waiting on the current round are released with an error
+    trial.abort()
+    del trials[trial_id]
+    app.logger.info("Delete trial %s", trial_id)
+    return {"trial-id": trial_id}
+
+
+def run_server(port: int) -> None:
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+    config.backlog = BACKLOG
+    config.keep_alive_timeout = KEEP_ALIVE_TIMEOUT
+    asyncio.run(serve(app, config))  # type: ignore
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", debug=True, port=settings.PORT)
+    app.logger.setLevel(logging.INFO)
+    if settings.SHARD_NUMBER == 1:
+        run_server(settings.PORT)
+    else:
+        # Each shard is an independent parameter server, which averages the
+        # layers assigned to it with its own barrier, on the port PORT + i.
+        shards = [
+            multiprocessing.Process(target=run_server, args=(settings.PORT + i,))
+            for i in range(settings.SHARD_NUMBER)
+        ]
+        for shard in shards:
+            shard.start()
+        for shard in shards:
+            shard.join()
@@ -0,0 +1,52 @@
+import math
+import time
+
+
+class SyncPeriodEstimator:
+    """Recommend a synchronization period (in steps) for a trial
+
+    A cycle of the synchronization is the interval between two consecutive rounds,
+    during which the slowest worker computes for `period` steps and then
+    synchronizes. So the communication time is what remains of the cycle after the
+    computation reported by the slowest worker. To spend the target fraction of the
+    time on the communication, the period satisfies
+
+        comm / (comm + period * step_time) <= overhead
+
+    Both the communication time and the step time are smoothed by an EWMA.
+    """
+
+    def __init__(self, alpha: float = 0.3) -> None:
+        self.alpha = alpha
+        self.comm_time: float | None = None
+        self.step_time: float | None = None
+        self.last_round_end: float | None = None
+
+    def _smooth(self, average: float | None, sample: float) -> float:
+        if average is None:
+            return sample
+        return self.alpha * sample + (1 - self.alpha) * average
+
+    def update(self, compute_time: float, steps: int, overhead: float) -> int | None:
+        """Record a finished round
+        args:
+            compute_time: the longest computation reported by the workers
+            steps: the number of steps of that computation
+            overhead: the target fraction of the time spent on synchronization
+        returns:
+            the recommended period, None if there is no estimate yet
+        """
+        now = time.perf_counter()
+        last_round_end, self.last_round_end = self.last_round_end, now
+        if last_round_end is None or steps <= 0:
+            return None
+        self.comm_time = self._smooth(
+            self.comm_time, max(now - last_round_end - compute_time, 0.0)
+        )
+        self.step_time = self._smooth(self.step_time, compute_time / steps)
+        if self.step_time <= 0:
+            return None
+        return max(
+            1,
+            math.ceil(self.comm_time * (1 - overhead) / (overhead * self.step_time)),
+        )
@@ -1,13 +1,26 @@
+# imported first, to time the other imports
+from profiler import startup_profiler  # isort: skip
+
 import argparse
+import copy
 import logging
 import os
 import pickle
 import time
 from typing import Any
 
+import numpy as np
+import torch
+import torch.nn as nn
+
 import exceptions
-import model as preset_model
-from cloud_train import train_model
+from cloud_train import (
+    SyncSetting,
+    TrainTelemetry,
+    report_completion,
+    runtime_cache,
+    train_model,
+)
 from hyperparameter import Hyperparameter
 from response import LambdaResponse, response_for_logging
 from utils import get_logger, get_model_weight, set_model_weight
@@ -21,6 +34,53 @@ class AWSLambdaContext:
 
 
 app_logger = get_logger(__name__)
+# the logging level set by the previous invocation of a warm container
+_logging_level: str | None = None
+
+
+def set_logging_level(logging_level: str) -> None:
+    global _logging_level
+    if logging_level == _logging_level:
+        return
+    # fragile next line
+    logging_level_id = getattr(logging, logging_level, logging.INFO)
+    loggers = [
+        app_logger,
+        logging.getLogger("cloud_train"),
+        # logging.getLogger("cloud_train.sync_weight"),
+        # logging.getLogger("cloud_train._train"),
+        # logging.getLogger("cloud_train._train.train_info"),
+        logging.getLogger("utils"),
+    ]
+    for logger in loggers:
+        logger.setLevel(logging_level_id)
+    _logging_level = logging_level
+
+
+def new_model(model_name: str) -> tuple[nn.Module, dict[str, Any]]:
+    # the model classes are only imported when a model is built
+    import model as preset_model
+
+    # a cold container always starts from the same initial weights
+    torch.random.manual_seed(0)
+    np.random.seed(0)
+    if model_name == "lenet":
+        model = preset_model.LeNet()
+    elif model_name == "resnet18":
+        model = preset_model.ResNet18()
+    else:
+        raise exceptions.LambdaExit("Unknown model name: %s" % model_name)
+    return model, copy.deepcopy(model.state_dict())
+
+
+def get_model(model_name: str) -> nn.Module:
+    """The model, reused by a warm container and reset to its initial weights"""
+    model, initial_weight = runtime_cache.get(
+        ("model", model_name), lambda: new_model(model_name)
+    )
+    model.load_state_dict(initial_weight)
+    model.zero_grad(set_to_none=True)
+    return model
 
 
 def check_required_env(*evs: str) -> None:
@@ -31,24 +91,15 @@ def check_required_env(*evs: str) -> None:
 
 
 def handler(event, context: AWSLambdaContext) -> dict[str, Any]:
+    startup_profiler.begin_invocation()
     response = LambdaResponse()
+    telemetry = TrainTelemetry()
     try:
         check_required_env("LAMBDA_TOTAL_TIME", "LAMBDA_TRAIN_LIMIT_TIME")
 
         # set all loggers according to the environment variable
         logging_level = os.environ.get("LAMBDA_LOGGING_LEVEL", "INFO")
-        # fragile next line
-        logging_level_id = getattr(logging, logging_level, logging.INFO)
-        loggers = [
-            app_logger,
-            logging.getLogger("cloud_train"),
-            # logging.getLogger("cloud_train.sync_weight"),
-            # logging.getLogger("cloud_train._train"),
-            # logging.getLogger("cloud_train._train.train_info"),
-            logging.getLogger("utils"),
-        ]
-        for logger in loggers:
-            logger.setLevel(logging_level_id)
+        set_logging_level(logging_level)
 
         app_logger.info("Use logging level: %s", logging_level)
 
@@ -73,6 +124,31 @@ def handler(event, context: AWSLambdaContext) -> dict[str, Any]:
             epoch = int(event["epoch"])
             proxy_url = event["proxy-url"]
             begin_epoch = int(event["begin-epoch"])
+            # optional: the model, the MODEL_NAME of the function by default
+            model_name = event.get("model-name") or os.getenv("MODEL_NAME", "lenet")
+            # optional: the step of "begin-epoch" to resume from
+            begin_step = int(event.get("begin-step", 0))
+            # optional: the checkpoint store, instead of "weight_hex"
+            checkpoint_url = event.get("checkpoint-url")
+            checkpoint_id = event.get("checkpoint-id")
+            sync = SyncSetting(
+                # optional: the parameter server shards
+                shard_urls=event.get("shard-urls"),
+                # optional: gradient sparsification
+                topk_ratio=event.get("topk-ratio"),
+                sparse_reply=event.get("sparse-reply", False),
+                # optional: gradient quantization
+                quant=event.get("quant", "fp32"),
+                stochastic_rounding=event.get("stochastic-rounding", False),
+                # optional: the synchronization schedule
+                mode=event.get("sync-mode", "epoch"),
+                period=event.get("sync-period", 1),
+                next_period=event.get("next-sync-period"),
+                overhead=event.get("sync-overhead"),
+                epoch_steps=event.get("epoch-steps"),
+                # optional: the index of the worker, for the quorum rounds
+                worker_id=event.get("worker-id"),
+            )
         except KeyError as e:
             raise exceptions.LambdaExit(
                 "Lambda handler receives an event without expected key: {}".format(e),
@@ -88,13 +164,8 @@ def handler(event, context: AWSLambdaContext) -> dict[str, Any]:
             momentum=momentum,
         )
 
-        model_name = os.getenv("MODEL_NAME", "lenet")
-        if model_name == "lenet":
-            model = preset_model.LeNet()
-        elif model_name == "resnet18":
-            model = preset_model.ResNet18()
-        else:
-            raise exceptions.LambdaExit("Unknown model name: %s" % model_name)
+        model = get_model(model_name)
+        startup_profiler.mark("model")
 
         if (weight_hex := event.get("weight_hex")) is not None:
             app_logger.debug("Loading model weight...")
@@ -105,22 +176,40 @@ def handler(event, context: AWSLambdaContext) -> dict[str, Any]:
             test_accuracy = train_model(
                 model,
                 hyperparameter,
+                model_name=model_name,
                 total_epoch=epoch,
                 begin_epoch=begin_epoch,
+                begin_step=begin_step,
                 slice_range=(slice_begin, slice_end),
                 proxy_url=proxy_url,
                 get_remaining_time=context.get_remaining_time_in_millis,
+                sync=sync,
+                checkpoint_url=checkpoint_url,
+                checkpoint_id=checkpoint_id,
+                telemetry=telemetry,
             )
             response.test_accuracy = test_accuracy
         except exceptions.LambdaExit as ex:
             if ex.restore:
                 # Lambda need to be restarted
                 response.restart = True
-                response.epoch = ex.cur_epoch + 1
-                model_weight = get_model_weight(model)
-                model_weight_hex = pickle.dumps(model_weight).hex()
-                response.weight_hex = model_weight_hex
-                app_logger.debug("Model weight size: %d bytes", len(model_weight_hex))
+                if ex.next_step == 0:
+                    response.epoch = ex.cur_epoch + 1
+                else:
+                    # resume in the middle of the epoch
+                    response.epoch = ex.cur_epoch
+                    response.step = ex.next_step
+                response.sync_period = ex.sync_period
+                response.next_sync_period = ex.next_sync_period
+                if ex.checkpoint_id is not None:
+                    response.checkpoint_id = ex.checkpoint_id
+                else:
+                    model_weight = get_model_weight(model)
+                    model_weight_hex = pickle.dumps(model_weight).hex()
+                    response.weight_hex = model_weight_hex
+                    app_logger.debug(
+                        "Model weight size: %d bytes", len(model_weight_hex)
+                    )
             else:
                 raise ex
     except exceptions.LambdaExit as ex:
@@ -136,9 +225,14 @@ def handler(event, context: AWSLambdaContext) -> dict[str, Any]:
     remaining_time_in_seconds = context.get_remaining_time_in_millis() / 1000
     app_logger.info("Remaining time: %.2f", remaining_time_in_seconds)
     response.leftTime = remaining_time_in_seconds
+    response.startup = startup_profiler.report()
+    response.telemetry = telemetry.model_dump()
 
     app_logger.debug("Lambda response: %s", response_for_logging(response.model_dump()))
 
+    # optional: the coordinator of an asynchronous invocation (event mode)
+    if (callback_url := event.get("callback-url")) is not None:
+        report_completion(callback_url, response.model_dump())
     return response.model_dump()
 
 
@@ -1 +1,5 @@
+from ._cache import runtime_cache
+from ._setting import SyncSetting
+from ._telemetry import TrainTelemetry
 from ._train import train_model
+from .callback import report_completion
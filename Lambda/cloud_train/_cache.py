@@ -0,0 +1,71 @@
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, TypeVar
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from utils import get_logger
+
+T = TypeVar("T")
+
+_logger = get_logger(__name__)
+
+
+def estimate_size(value: Any) -> int:
+    """The bytes of the arrays held by a value, the rest is negligible"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, nn.Module):
+        return estimate_size(value.state_dict())
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_size(v) for v in value)
+    return 0
+
+
+class RuntimeCache:
+    """The objects kept by a warm container across the invocations
+
+    The entries are evicted in the least recently used order, once their total
+    size exceeds the cap. An entry larger than the cap is not kept at all.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def get(self, key: Hashable, create: Callable[[], T]) -> T:
+        """
+        args:
+            create: build the value on a miss
+        """
+        if (entry := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+            _logger.debug("Runtime cache hit: %s", key)
+            return entry[0]
+
+        value = create()
+        size = estimate_size(value)
+        if size > self.max_size:
+            _logger.info("Too large for the runtime cache: %s, %d bytes", key, size)
+            return value
+        while self.size + size > self.max_size:
+            evicted, (_, evicted_size) = self.entries.popitem(last=False)
+            self.size -= evicted_size
+            _logger.info("Evict from the runtime cache: %s", evicted)
+        self.entries[key] = (value, size)
+        self.size += size
+        return value
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+
+runtime_cache = RuntimeCache(int(os.environ.get("RUNTIME_CACHE_SIZE", 1024)) << 20)
@@ -0,0 +1,74 @@
+import json
+import math
+import os
+
+import numpy as np
+import torch
+
+# the dataset of each model
+DATASETS = {"lenet": "mnist", "resnet18": "cifar10"}
+INDEX_FILE = "index.json"
+
+
+def cache_dir(dataset: str) -> str:
+    return os.path.join(os.environ.get("DATA_CACHE_DIR", "./data/cache"), dataset)
+
+
+def has_cache(dataset: str) -> bool:
+    return os.path.isfile(os.path.join(cache_dir(dataset), INDEX_FILE))
+
+
+class ShardLoader:
+    """The batches of whole arrays of samples, in place of a DataLoader
+
+    A batch is a single slice of the arrays rather than a collation of samples.
+    If the arrays are memory-mapped, only the pages of the slice are read.
+    """
+
+    def __init__(
+        self, x: np.ndarray, y: np.ndarray, scale: float, batch_size: int
+    ) -> None:
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.scale = scale
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.x) / self.batch_size)
+
+    def __iter__(self):
+        return self.batches()
+
+    def batches(self, begin_step: int = 0):
+        """The batches from a step, to resume in the middle of an epoch"""
+        first = begin_step * self.batch_size
+        for begin in range(first, len(self.x), self.batch_size):
+            end = begin + self.batch_size
+            # a copy out of the read-only mapping, converted to float32 at once
+            x = self.x[begin:end].astype(np.float32)
+            if self.scale != 1:
+                x *= self.scale
+            yield torch.from_numpy(x), torch.from_numpy(
+                self.y[begin:end].astype(np.int64)
+            )
+
+
+def load_shard(
+    dataset: str, split: str, slice_range: tuple[int, int] | None = None
+) -> tuple[np.ndarray, np.ndarray, float]:
+    """Load a split of a preprocessed dataset (see `prepare_data.py`)
+    args:
+        split: "train" | "test"
+        slice_range: the samples to load, None for the whole split
+    returns:
+        the memory-mapped images and labels, and the scale to apply to the images
+    """
+    root = cache_dir(dataset)
+    with open(os.path.join(root, INDEX_FILE)) as f:
+        index = json.load(f)
+    entry = index[split]
+    x = np.load(os.path.join(root, entry["x"]), mmap_mode="r")
+    y = np.load(os.path.join(root, entry["y"]), mmap_mode="r")
+    if slice_range is not None:
+        x, y = x[slice(*slice_range)], y[slice(*slice_range)]
+    return x, y, index["scale"]
@@ -0,0 +1,95 @@
+import time
+from typing import Mapping
+
+from protocol import (
+    COMPUTE_TIME_HEADER,
+    SYNC_OVERHEAD_HEADER,
+    SYNC_PERIOD_HEADER,
+    SYNC_STEPS_HEADER,
+    WORKER_ID_HEADER,
+)
+
+from ._setting import SyncSetting
+
+
+class SyncScheduler:
+    """Decide at which steps a worker synchronizes with the parameter server
+
+    All the workers must synchronize the same number of times, otherwise the
+    barrier of the parameter server never completes. So the steps are counted from
+    the beginning of each epoch, only within the steps that all the workers have.
+
+    With a target overhead, the workers report their computation time, and the
+    parameter server recommends a period in the reply. Since every worker receives
+    the same reply, the last recommendation of an epoch is applied to the next
+    epoch by all of them, and the period never changes within an epoch.
+    """
+
+    def __init__(self, setting: SyncSetting, epoch_steps: int) -> None:
+        self.mode = setting.mode
+        self.overhead = setting.overhead
+        self.worker_id = setting.worker_id
+        self.epoch_steps = setting.epoch_steps or epoch_steps
+        self.period = min(setting.period, self.epoch_steps)
+        self.next_period = setting.next_period
+        self.steps_since_sync = 0
+        self.compute_begin = time.perf_counter()
+
+    def start_epoch(self) -> None:
+        if self.next_period is not None:
+            self.period = min(self.next_period, self.epoch_steps)
+        self.steps_since_sync = 0
+        self.compute_begin = time.perf_counter()
+
+    def resume(self, step: int) -> None:
+        """Resume an epoch from a step, with the period already in effect"""
+        self.steps_since_sync = min(step, self.epoch_steps) % self.period
+        self.compute_begin = time.perf_counter()
+
+    def step(self, step: int) -> bool:
+        """Count a step of an epoch
+        returns:
+            whether to synchronize after the step
+        """
+        if self.mode == "epoch" or step >= self.epoch_steps:
+            return False
+        self.steps_since_sync += 1
+        # the grads accumulated by the last steps of an epoch are synchronized as
+        # well, or they would be dropped
+        return self.steps_since_sync == self.period or (
+            self.mode == "grad" and step == self.epoch_steps - 1
+        )
+
+    def headers(self) -> dict[str, str]:
+        """The headers identifying the worker, and reporting the computation since
+        the last synchronization
+        """
+        headers = dict()
+        if self.worker_id is not None:
+            headers[WORKER_ID_HEADER] = str(self.worker_id)
+        if self.overhead is None:
+            return headers
+        return {
+            **headers,
+            SYNC_STEPS_HEADER: str(self.steps_since_sync),
+            COMPUTE_TIME_HEADER: "{:.6f}".format(
+                time.perf_counter() - self.compute_begin
+            ),
+            SYNC_OVERHEAD_HEADER: str(self.overhead),
+        }
+
+    def synced(self, reply_headers: list[Mapping[str, str]]) -> None:
+        """Start over after a synchronization
+        args:
+            reply_headers: the headers of the reply of each shard
+        """
+        # the shards estimate separately, follow the most conservative one
+        periods = [
+            int(period)
+            for headers in reply_headers
+            if (period := headers.get(SYNC_PERIOD_HEADER)) is not None
+        ]
+        if periods:
+            self.next_period = max(periods)
+        self.steps_since_sync = 0
+        self.compute_begin = time.perf_counter()
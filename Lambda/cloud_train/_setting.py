@@ -0,0 +1,34 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field, NonNegativeInt, PositiveInt
+
+
+class SyncSetting(BaseModel):
+    """How a worker synchronizes with the parameter server"""
+
+    # the parameter server shards, None if not sharded
+    shard_urls: list[str] | None = None
+    # top-k sparsification of the sent grads, None to disable
+    topk_ratio: float | None = Field(default=None, gt=0, le=1)
+    # whether the parameter server replies with the same top-k ratio
+    sparse_reply: bool = False
+    quant: Literal["fp32", "fp16", "int8"] = "fp32"
+    stochastic_rounding: bool = False
+    # "epoch": sync the grads once at the end of each epoch
+    # "grad": accumulate the grads of `period` steps, then sync them and take one
+    # optimizer step, so the weights of the workers stay the same
+    # "local-sgd": train locally for `period` steps, then average the weight deltas
+    mode: Literal["epoch", "grad", "local-sgd"] = "epoch"
+    period: PositiveInt = 1
+    # the period recommended for the next epoch, carried over a restart in the
+    # middle of an epoch
+    next_period: PositiveInt | None = None
+    # the target fraction of the time spent on synchronization, which enables
+    # the parameter server to adapt the period; None to keep the period fixed
+    overhead: float | None = Field(default=None, gt=0, lt=1)
+    # the number of steps of an epoch that all the workers have, since the data
+    # slices may differ by a batch; None to use the length of the own slice
+    epoch_steps: PositiveInt | None = None
+    # the index of the worker in its trial, which lets the parameter server close
+    # a round without the stragglers; None if it waits for all the workers
+    worker_id: NonNegativeInt | None = None
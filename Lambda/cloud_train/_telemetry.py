@@ -0,0 +1,25 @@
+from pydantic import BaseModel, NonNegativeFloat, NonNegativeInt
+
+
+class TrainTelemetry(BaseModel):
+    """The time spent by a worker, reported to the coordinator to model the trials
+
+    The times are in seconds. The synchronization is excluded from the compute time
+    of the steps, whether it is done in a step or at the end of an epoch.
+    """
+
+    steps: NonNegativeInt = 0
+    # the samples of the steps
+    samples: NonNegativeInt = 0
+    compute_time: NonNegativeFloat = 0.0
+    syncs: NonNegativeInt = 0
+    sync_time: NonNegativeFloat = 0.0
+
+    def record_step(self, duration: float, samples: int) -> None:
+        self.steps += 1
+        self.samples += samples
+        self.compute_time += duration
+
+    def record_sync(self, duration: float) -> None:
+        self.syncs += 1
+        self.sync_time += duration
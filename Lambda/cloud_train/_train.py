@@ -1,23 +1,27 @@
 import logging
 import os
 import sys
+import time
 from typing import Callable
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-import torchvision  # type: ignore
-from torch.utils.data import DataLoader, Subset
 
 from exceptions import LambdaExit
 from hyperparameter import Hyperparameter
-from utils import get_logger, predict_if_restart
+from profiler import startup_profiler
+from protocol import Quantizer, TopKCompressor
+from utils import RestartPredictor, get_logger
 
-from .sync_weight import update_model
-
-torch.random.manual_seed(0)
-np.random.seed(0)
+from ._cache import runtime_cache
+from ._dataset import DATASETS, ShardLoader, has_cache, load_shard
+from ._scheduler import SyncScheduler
+from ._setting import SyncSetting
+from ._telemetry import TrainTelemetry
+from .checkpoint import load_checkpoint, new_checkpoint_id, save_checkpoint
+from .sync_weight import average_model, update_model
 
 _logger = get_logger(__name__)
 
@@ -35,62 +39,92 @@ _train_logger_handler.setFormatter(
 _train_logger.addHandler(_train_logger_handler)
 
 
-def get_data_loader(batch_size: int, slice_range: tuple[int, int]):
-    model_name = os.getenv("MODEL_NAME", "lenet")
-    if model_name == "lenet":
-        train_set = torchvision.datasets.MNIST(
-            root="./data",
-            train=True,
-            download=False,
-            transform=torchvision.transforms.ToTensor(),
-        )
-        test_set = torchvision.datasets.MNIST(
-            root="./data",
-            train=False,
-            download=False,
-            transform=torchvision.transforms.ToTensor(),
-        )
-    elif model_name == "resnet18":
-        train_set = torchvision.datasets.CIFAR10(
+def load_tensors(
+    model_name: str, train: bool, slice_range: tuple[int, int] | None
+) -> tuple[np.ndarray, np.ndarray, float]:
+    """Load the samples of a split as whole arrays
+    From the preprocessed shard cache if present, otherwise converted once from the
+    torchvision dataset.
+    returns:
+        the images, the labels, and the scale to apply to the images
+    """
+    dataset = DATASETS.get(model_name)
+    if dataset is None:
+        raise LambdaExit("Unknown model name: %s" % model_name)
+    if has_cache(dataset):
+        return load_shard(dataset, "train" if train else "test", slice_range)
+
+    # torchvision is slow to import, and not needed with the shard cache
+    import torchvision  # type: ignore
+    from torch.utils.data import DataLoader, Subset
+
+    if dataset == "mnist":
+        data_set = torchvision.datasets.MNIST(
             root="./data",
-            train=True,
+            train=train,
             download=False,
             transform=torchvision.transforms.ToTensor(),
         )
-        test_set = torchvision.datasets.CIFAR10(
+    else:
+        data_set = torchvision.datasets.CIFAR10(
             root="./data",
-            train=False,
+            train=train,
             download=False,
             transform=torchvision.transforms.ToTensor(),
         )
-    train_set_slice = Subset(train_set, np.arange(*slice_range))  # type: ignore
-    train_loader = DataLoader(
-        train_set_slice,
-        batch_size=batch_size,
-        shuffle=False,
-        num_workers=0,
+    if slice_range is not None:
+        data_set = Subset(data_set, np.arange(*slice_range))  # type: ignore
+    # convert all the samples at once, so they are kept as tensors
+    x, y = next(iter(DataLoader(data_set, batch_size=len(data_set))))  # type: ignore
+    return x.numpy(), y.numpy(), 1.0
+
+
+def get_data_loader(model_name: str, batch_size: int, slice_range: tuple[int, int]):
+    """The loaders of the data slice and of the test set
+    The loaded samples are kept by a warm container (see `runtime_cache`), so only
+    the first invocation on a slice loads it.
+    """
+    train_tensors = runtime_cache.get(
+        ("train", model_name, slice_range),
+        lambda: load_tensors(model_name, True, slice_range),
     )
     _logger.info("Worker get data slice %s", slice_range)
-    test_loader = DataLoader(
-        test_set,
-        batch_size=batch_size,
-        shuffle=False,
-        num_workers=0,
+    test_tensors = runtime_cache.get(
+        ("test", model_name), lambda: load_tensors(model_name, False, None)
+    )
+    return (
+        ShardLoader(*train_tensors, batch_size),
+        ShardLoader(*test_tensors, batch_size),
     )
-
-    return train_loader, test_loader
 
 
 def train_model(
     model: nn.Module,
     hyperparameter: Hyperparameter,
     *,
+    model_name: str = "lenet",
     begin_epoch: int,
+    begin_step: int = 0,
     total_epoch: int,
     slice_range: tuple[int, int],
     proxy_url: str,
     get_remaining_time: Callable[[], int],
+    sync: SyncSetting | None = None,
+    checkpoint_url: str | None = None,
+    checkpoint_id: str | None = None,
+    telemetry: TrainTelemetry | None = None,
 ):
+    """
+    args:
+        model_name: the model, which decides the dataset
+        begin_step: the step of `begin_epoch` to resume from
+        checkpoint_url: the checkpoint store to save the state to before a restart,
+            None to leave it to the caller
+        checkpoint_id: the checkpoint to resume from, which is overwritten by the
+            next one
+        telemetry: records the time of the steps and the synchronizations, even if
+            the training is interrupted by a restart
+    """
     loss_function = nn.CrossEntropyLoss()
 
     optimizer = optim.SGD(
@@ -99,29 +133,146 @@ def train_model(
         momentum=hyperparameter.momentum,
     )
 
-    train_loader, test_loader = get_data_loader(hyperparameter.batch_size, slice_range)
+    saved_anchor: list[np.ndarray | None] = list()
+    saved_residuals: list[np.ndarray | None] = list()
+    if checkpoint_url is not None and checkpoint_id is not None:
+        saved_anchor, saved_residuals = load_checkpoint(
+            checkpoint_url, checkpoint_id, model, optimizer
+        )
+
+    train_loader, test_loader = get_data_loader(
+        model_name, hyperparameter.batch_size, slice_range
+    )
+    startup_profiler.mark("data")
+
+    sync = sync or SyncSetting()
+    # the residuals of top-k sparsification live as long as the training
+    compressor = None if sync.topk_ratio is None else TopKCompressor(sync.topk_ratio)
+    if compressor is not None and any(r is not None for r in saved_residuals):
+        compressor.residuals = saved_residuals
+    sync_kwargs = dict(
+        url=proxy_url,
+        shard_urls=sync.shard_urls,
+        compressor=compressor,
+        sparse_reply=sync.sparse_reply,
+        quantizer=Quantizer(sync.quant, stochastic=sync.stochastic_rounding),
+    )
+    scheduler = SyncScheduler(sync, len(train_loader))
+    # the weights after the last average, for local SGD; a restart may fall
+    # between two averages, so the anchor is not the restored weights then
+    params = list(model.parameters())
+    anchor = [
+        p.data.cpu().numpy().copy() if a is None else a
+        for p, a in zip(params, saved_anchor or [None] * len(params))
+    ]
 
     model.train()
     logging_gap: int = int(os.environ.get("TRAIN_LOGGING_GAP", 10))
+    predictor = RestartPredictor()
+    telemetry = telemetry or TrainTelemetry()
+    total_steps = len(train_loader)
+
+    def restart(epoch: int, step: int) -> LambdaExit:
+        """Save the state and restart from the step of the epoch"""
+        nonlocal checkpoint_id
+        local_sgd = sync.mode == "local-sgd"
+        if checkpoint_url is not None:
+            checkpoint_id = checkpoint_id or new_checkpoint_id()
+            save_checkpoint(
+                checkpoint_url,
+                checkpoint_id,
+                model,
+                optimizer,
+                anchor=anchor if local_sgd else None,
+                residuals=None if compressor is None else compressor.residuals,
+            )
+        elif local_sgd:
+            # without a checkpoint store only the weights are carried over, so the
+            # local steps since the last average are dropped; the restored weights
+            # would be taken as the anchor, and drift from the other workers
+            with torch.no_grad():
+                for p, a in zip(model.parameters(), anchor):
+                    p.copy_(torch.from_numpy(a))
+        if step == 0:
+            epoch, step = epoch - 1, total_steps
+        return LambdaExit(
+            restore=True,
+            cur_epoch=epoch,
+            next_step=0 if step == total_steps else step,
+            sync_period=scheduler.period,
+            next_sync_period=scheduler.next_period,
+            checkpoint_id=checkpoint_id if checkpoint_url is not None else None,
+        )
 
     for epoch in range(begin_epoch, total_epoch):
-        for i, (train_x, train_label) in enumerate(train_loader):
-            optimizer.zero_grad()
+        first_step = begin_step if epoch == begin_epoch else 0
+        if first_step == 0:
+            scheduler.start_epoch()
+        else:
+            scheduler.resume(first_step)
+        batches = train_loader.batches(first_step)
+        # the grads of the steps since the last sync, in grad mode; those of a
+        # restarted period are lost, and the period is averaged over the rest
+        optimizer.zero_grad()
+        accumulated = 0
+        for i, (train_x, train_label) in enumerate(batches, first_step):
+            startup_profiler.mark("first-batch")
+            with_sync = sync.mode == "epoch" and i == total_steps - 1
+            if predictor.should_restart(get_remaining_time(), with_sync):
+                raise restart(epoch, i)
+            step_begin = time.perf_counter()
+            sync_time = 0.0
+
+            if sync.mode != "grad":
+                optimizer.zero_grad()
             output = model(train_x)
             loss = loss_function(output, train_label)
             loss.backward()
-            optimizer.step()
+            accumulated += 1
+            if should_sync := scheduler.step(i):
+                if sync.mode == "grad":
+                    sync_begin = time.perf_counter()
+                    with torch.no_grad():
+                        for p in model.parameters():
+                            if p.grad is not None:
+                                p.grad.div_(accumulated)
+                    scheduler.synced(
+                        update_model(model, headers=scheduler.headers(), **sync_kwargs)
+                    )
+                    sync_time = time.perf_counter() - sync_begin
+            if sync.mode != "grad":
+                optimizer.step()
+            elif should_sync:
+                # every worker steps with the same averaged grads
+                optimizer.step()
+                optimizer.zero_grad()
+                accumulated = 0
+            if should_sync and sync.mode == "local-sgd":
+                sync_begin = time.perf_counter()
+                scheduler.synced(
+                    average_model(
+                        model, anchor, headers=scheduler.headers(), **sync_kwargs
+                    )
+                )
+                sync_time = time.perf_counter() - sync_begin
             if i % logging_gap == 0:
                 _train_logger.info(
                     f"Epoch {epoch + 1}, step {i}, loss: {loss.item():.3f}"
                 )
+            step_time = time.perf_counter() - step_begin
+            predictor.record_step(step_time * 1000)
+            telemetry.record_step(step_time - sync_time, len(train_label))
+            if should_sync and sync.mode != "epoch":
+                telemetry.record_sync(sync_time)
 
-        # Each epoch, sync the weight with parameter server
-        _logger.info("Epoch %d, sync weight with parameter server", epoch)
-        update_model(model, url=proxy_url)
-
-        if epoch != total_epoch - 1 and predict_if_restart(epoch, get_remaining_time()):
-            raise LambdaExit(restore=True, cur_epoch=epoch)
+        if sync.mode == "epoch":
+            # Each epoch, sync the weight with parameter server
+            _logger.info("Epoch %d, sync weight with parameter server", epoch)
+            sync_begin = time.perf_counter()
+            update_model(model, headers=scheduler.headers(), **sync_kwargs)
+            sync_time = time.perf_counter() - sync_begin
+            predictor.record_sync(sync_time * 1000)
+            telemetry.record_sync(sync_time)
 
     model.eval()
     # test the model
@@ -0,0 +1,32 @@
+from typing import Any
+
+import requests
+
+from utils import get_logger
+
+from .client import get_session, get_timeout
+
+logger = get_logger(__name__)
+
+
+def report_completion(url: str, response: dict[str, Any]) -> bool:
+    """Report the response of an asynchronous invocation to the coordinator
+    An invocation of the event mode has no caller waiting for its return value, so
+    the response, including a restart request, is sent to the callback URL instead.
+    The report is a PUT, so it is retried like the other idempotent requests, and a
+    duplicate is ignored by the coordinator.
+    args:
+        url: the callback URL of the invocation, from "callback-url" of the event
+    returns:
+        whether the coordinator receives the report
+    """
+    try:
+        res = get_session().put(url, json=response, timeout=get_timeout())
+    except requests.RequestException as e:
+        logger.error("Fail to report the completion to %s: %s", url, e)
+        return False
+    if res.status_code != 200:
+        logger.error("The completion is rejected by %s: %s", url, res.text)
+        return False
+    logger.debug("Report the completion to %s", url)
+    return True
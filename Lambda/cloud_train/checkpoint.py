@@ -0,0 +1,121 @@
+import uuid
+
+import numpy as np
+import requests
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from exceptions import LambdaExit
+from protocol import CONTENT_TYPE, decode_grads, encode_grads
+from utils import get_logger
+
+from .client import get_session, get_timeout
+
+logger = get_logger(__name__)
+
+
+def new_checkpoint_id() -> str:
+    return uuid.uuid4().hex
+
+
+def checkpoint_arrays(
+    model: nn.Module,
+    optimizer: optim.Optimizer,
+    anchor: list[np.ndarray] | None = None,
+    residuals: list[np.ndarray | None] | None = None,
+) -> list[np.ndarray | None]:
+    """The state to restart from
+    The state dict of the model (including the buffers, e.g. of the batch norm)
+    followed by, for each parameter, the momentum buffer, the anchor of local SGD
+    and the residual of top-k sparsification, None if there is none.
+    The order only depends on the model, so no names are needed.
+    args:
+        anchor: the weights after the last average, see `average_model`
+        residuals: the residuals of `TopKCompressor`, one per parameter
+    """
+    params = list(model.parameters())
+    arrays: list[np.ndarray | None] = [
+        t.detach().cpu().numpy() for t in model.state_dict().values()
+    ]
+    for p in params:
+        momentum = optimizer.state.get(p, {}).get("momentum_buffer")
+        arrays.append(None if momentum is None else momentum.cpu().numpy())
+    arrays.extend(anchor or [None] * len(params))
+    arrays.extend(residuals or [None] * len(params))
+    return arrays
+
+
+def restore_arrays(
+    model: nn.Module, optimizer: optim.Optimizer, arrays: list[np.ndarray | None]
+) -> tuple[list[np.ndarray | None], list[np.ndarray | None]]:
+    """Restore the model and the optimizer
+    returns:
+        the anchor and the residuals, see `checkpoint_arrays`
+    """
+    state_dict = model.state_dict()
+    params = list(model.parameters())
+    if len(arrays) != len(state_dict) + 3 * len(params):
+        raise LambdaExit("The checkpoint does not match the model")
+    model.load_state_dict(
+        {
+            name: torch.from_numpy(array)
+            for name, array in zip(state_dict.keys(), arrays)
+        }
+    )
+    per_param = arrays[len(state_dict) :]
+    for p, momentum in zip(params, per_param[: len(params)]):
+        if momentum is not None:
+            optimizer.state[p]["momentum_buffer"] = torch.from_numpy(momentum)
+    return per_param[len(params) : 2 * len(params)], per_param[2 * len(params) :]
+
+
+def save_checkpoint(
+    url: str,
+    checkpoint_id: str,
+    model: nn.Module,
+    optimizer: optim.Optimizer,
+    *,
+    anchor: list[np.ndarray] | None = None,
+    residuals: list[np.ndarray | None] | None = None,
+) -> None:
+    """Upload the weights, the momentum and the synchronization state to the
+    checkpoint store
+    args:
+        url: the checkpoint store, e.g. http://127.0.0.1:8080/checkpoints
+        anchor, residuals: see `checkpoint_arrays`
+    """
+    frame = encode_grads(
+        checkpoint_arrays(model, optimizer, anchor, residuals)  # type: ignore
+    )
+    try:
+        res = get_session().put(
+            f"{url}/{checkpoint_id}",
+            data=frame,
+            headers={"Content-Type": CONTENT_TYPE},
+            timeout=get_timeout(),
+        )
+    except requests.RequestException as e:
+        raise LambdaExit("While saving the checkpoint, request error occurred") from e
+    if res.status_code != 200:
+        raise LambdaExit("While saving the checkpoint, response error occurred.")
+    logger.info("Save checkpoint %s: %d bytes", checkpoint_id, len(frame))
+
+
+def load_checkpoint(
+    url: str, checkpoint_id: str, model: nn.Module, optimizer: optim.Optimizer
+) -> tuple[list[np.ndarray | None], list[np.ndarray | None]]:
+    """Restore the model and the optimizer from the checkpoint store
+    returns:
+        the anchor and the residuals, see `checkpoint_arrays`
+    """
+    try:
+        res = get_session().get(f"{url}/{checkpoint_id}", timeout=get_timeout())
+    except requests.RequestException as e:
+        raise LambdaExit("While loading the checkpoint, request error occurred") from e
+    if res.status_code != 200:
+        raise LambdaExit("Fail to load checkpoint: {}".format(checkpoint_id))
+    # the arrays are handed to torch, so decode them from a writable buffer
+    state = restore_arrays(model, optimizer, decode_grads(bytearray(res.content)))
+    logger.info("Load checkpoint %s: %d bytes", checkpoint_id, len(res.content))
+    return state
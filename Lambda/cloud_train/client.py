@@ -0,0 +1,56 @@
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+# module-level, so the connections survive across the synchronizations and
+# the warm invocations of the Lambda
+_session: requests.Session | None = None
+
+
+def get_session() -> requests.Session:
+    """The connection-pooled session to the parameter server
+
+    Only idempotent requests (e.g. GET) are retried on a bad gateway or a broken
+    connection, with exponential backoff. Pushing grads is not, as it counts in
+    the barrier of a round; it is only retried if the connection cannot be
+    established, i.e. the request is never sent.
+    """
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=int(os.environ.get("PS_MAX_RETRIES", 3)),
+            backoff_factor=float(os.environ.get("PS_RETRY_BACKOFF", 0.5)),
+            status_forcelist=(502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False,
+        )
+        # the shards are synchronized in parallel, each with a connection
+        pool_size = int(os.environ.get("PS_POOL_SIZE", 16))
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        logger.debug("Create the session to the parameter server")
+    return _session
+
+
+def get_timeout() -> tuple[float, float | None]:
+    """The connect and read timeouts in seconds
+    The read timeout covers the wait on the barrier, i.e. the slowest worker, so it
+    defaults to the lifetime of the Lambda.
+    """
+    connect_timeout = float(os.environ.get("PS_CONNECT_TIMEOUT", 10))
+    read_timeout = os.environ.get(
+        "PS_READ_TIMEOUT", os.environ.get("LAMBDA_TOTAL_TIME")
+    )
+    return connect_timeout, None if read_timeout is None else float(read_timeout)
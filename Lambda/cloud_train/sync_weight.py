@@ -1,44 +1,198 @@
-import pickle
+from concurrent.futures import ThreadPoolExecutor
+from typing import Mapping
 
+import numpy as np
 import requests
+import torch
 import torch.nn as nn
 
 from exceptions import LambdaExit
+from protocol import (
+    CONTENT_TYPE,
+    REPLY_QUANT_HEADER,
+    REPLY_STOCHASTIC_HEADER,
+    REPLY_TOPK_HEADER,
+    Grad,
+    Quantizer,
+    TopKCompressor,
+    decode_grads,
+    encode_grads,
+)
 from utils import get_logger, get_model_gradients, set_model_gradients
 
+from .client import get_session, get_timeout
+
 logger = get_logger(__name__)
 
+# pushes the shards in parallel, kept across synchronizations
+_shard_executor: ThreadPoolExecutor | None = None
+_shard_executor_size = 0
 
-def update_model(model: nn.Module, *, url: str = "http://127.0.0.1:8080/ps") -> None:
-    """
-    update the model via communicating with the parameter server
 
-    return 0 if success, -1 if error
+def partition_layers(sizes: list[int], shard_number: int) -> list[list[int]]:
+    """Assign the layers to the parameter server shards
+    The largest layers are assigned first, each to the least loaded shard. All the
+    workers get the same partition since it only depends on the layer sizes.
+    args:
+        sizes: the number of parameters of each layer
+    returns:
+        the indices of the layers assigned to each shard, in ascending order
     """
+    shards: list[list[int]] = [list() for _ in range(shard_number)]
+    loads = [0] * shard_number
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i], i)):
+        shard = min(range(shard_number), key=lambda j: (loads[j], j))
+        shards[shard].append(i)
+        loads[shard] += sizes[i]
+    return [sorted(shard) for shard in shards]
 
-    grads = get_model_gradients(model)
-    grads_hex = pickle.dumps(grads).hex()
 
-    # TODO hex isn't very space-efficient, consider other encoding
-    logger.debug("Send request with grads size: {:d} bytes".format(len(grads_hex)))
-    res = requests.post(
-        # Tell the server if the Lambda need a restart
-        url,
-        json={"grads": grads_hex},
-        timeout=None,
-    )
+def push_grads(
+    url: str,
+    grads: list[Grad | None],
+    quantizer: Quantizer | None,
+    headers: dict[str, str],
+) -> tuple[list[np.ndarray | None], Mapping[str, str]]:
+    """
+    returns:
+        the averaged grads, and the headers of the reply
+    """
+    frame = encode_grads(grads, quantizer)
+
+    logger.debug("Send request with grads size: {:d} bytes".format(len(frame)))
+    try:
+        res = get_session().post(
+            # Tell the server if the Lambda need a restart
+            url,
+            data=frame,
+            headers=headers,
+            timeout=get_timeout(),
+        )
+    except requests.RequestException as e:
+        raise LambdaExit(
+            "While synchronizing the weight, request error occurred: {}".format(e)
+        ) from e
     if res.status_code != 200:
         raise LambdaExit("While synchronizing the weight, response error occurred.")
 
-    response_json = res.json()
-    new_grads_hex = response_json.get("new-grads")
-    if new_grads_hex is None:
+    if res.headers.get("Content-Type") != CONTENT_TYPE:
         raise LambdaExit("Lambda is closed intentionally (because of unexpected loss).")
 
     logger.debug(
-        "Receive response with grads size: {:d} bytes".format(len(new_grads_hex))
+        "Receive response with grads size: {:d} bytes".format(len(res.content))
+    )
+
+    # the gradients are handed to torch, so decode them from a writable buffer
+    return decode_grads(bytearray(res.content)), res.headers
+
+
+def exchange(
+    arrays: list[np.ndarray | None],
+    *,
+    url: str,
+    shard_urls: list[str] | None = None,
+    compressor: TopKCompressor | None = None,
+    sparse_reply: bool = False,
+    quantizer: Quantizer | None = None,
+    headers: dict[str, str] | None = None,
+) -> tuple[list[np.ndarray | None], list[Mapping[str, str]]]:
+    """
+    average a list of arrays (e.g. the grads) with the other workers via the
+    parameter server
+
+    If shard URLs are given, the layers are partitioned across the shards (see
+    `partition_layers`), which are synchronized in parallel.
+    If a compressor is given, only the top-k entries of the arrays are sent, and
+    the rest is kept by the compressor for the next synchronization. If
+    `sparse_reply` is set as well, the parameter server replies with the same top-k
+    ratio.
+    If a quantizer is given, the arrays are quantized both ways.
+    returns:
+        the averaged arrays, and the headers of the reply of each shard
+    """
+    global _shard_executor, _shard_executor_size
+
+    grads: list[Grad | None] = arrays  # type: ignore
+    headers = {"Content-Type": CONTENT_TYPE, **(headers or {})}
+    if compressor is not None:
+        grads = compressor.compress(arrays)
+        if sparse_reply:
+            headers[REPLY_TOPK_HEADER] = str(compressor.ratio)
+    if quantizer is not None:
+        headers[REPLY_QUANT_HEADER] = quantizer.method
+        if quantizer.stochastic:
+            headers[REPLY_STOCHASTIC_HEADER] = "1"
+
+    if not shard_urls:
+        new_grads, reply_headers = push_grads(url, grads, quantizer, headers)
+        return new_grads, [reply_headers]
+
+    partition = partition_layers(
+        [0 if a is None else a.size for a in arrays], len(shard_urls)
     )
+    if _shard_executor is None or _shard_executor_size < len(shard_urls):
+        # every shard must be pushed concurrently, as each one is a barrier
+        if _shard_executor is not None:
+            # the container is kept warm, so the threads would leak otherwise
+            _shard_executor.shutdown(wait=False)
+        _shard_executor = ThreadPoolExecutor(max_workers=len(shard_urls))
+        _shard_executor_size = len(shard_urls)
+    futures = [
+        _shard_executor.submit(
+            push_grads, shard_url, [grads[i] for i in layers], quantizer, headers
+        )
+        for shard_url, layers in zip(shard_urls, partition)
+    ]
+    new_grads: list[np.ndarray | None] = [None] * len(grads)
+    shard_headers: list[Mapping[str, str]] = list()
+    for layers, future in zip(partition, futures):
+        shard_grads, reply_headers = future.result()
+        for i, grad in zip(layers, shard_grads):
+            new_grads[i] = grad
+        shard_headers.append(reply_headers)
+    return new_grads, shard_headers
+
 
-    new_grads = pickle.loads(bytes.fromhex(new_grads_hex))
+def update_model(model: nn.Module, **kwargs) -> list[Mapping[str, str]]:
+    """
+    update the model via communicating with the parameter server, i.e. replace the
+    grads with the averaged ones of all the workers
+    args:
+        kwargs: see `exchange`
+    returns:
+        the headers of the reply of each shard
+    """
+    new_grads, reply_headers = exchange(get_model_gradients(model), **kwargs)
     set_model_gradients(model, new_grads)
     logger.info("Successfully update model!")
+    return reply_headers
+
+
+def average_model(
+    model: nn.Module, anchor: list[np.ndarray], **kwargs
+) -> list[Mapping[str, str]]:
+    """
+    average the weights of the model with the other workers (local SGD)
+
+    Only the deltas since the last average, i.e. the anchor, are exchanged, which
+    behave like the grads for the sparsification and the quantization. The anchor
+    is moved to the averaged weights in place.
+    args:
+        anchor: the weights after the last average
+        kwargs: see `exchange`
+    returns:
+        the headers of the reply of each shard
+    """
+    params = list(model.parameters())
+    deltas: list[np.ndarray | None] = [
+        p.data.cpu().numpy() - a for p, a in zip(params, anchor)
+    ]
+    new_deltas, reply_headers = exchange(deltas, **kwargs)
+    with torch.no_grad():
+        for p, a, delta in zip(params, anchor, new_deltas):
+            if delta is None:
+                continue
+            a += delta
+            p.copy_(torch.from_numpy(a))
+    logger.info("Successfully average model!")
+    return reply_headers
@@ -1,10 +1,29 @@
 class LambdaExit(BaseException):
     restore: bool
     cur_epoch: int
+    next_step: int
+    sync_period: int | None
+    next_sync_period: int | None
+    checkpoint_id: str | None
 
     def __init__(
-        self, *args: object, restore: bool = False, cur_epoch: int = 0
+        self,
+        *args: object,
+        restore: bool = False,
+        cur_epoch: int = 0,
+        next_step: int = 0,
+        sync_period: int | None = None,
+        next_sync_period: int | None = None,
+        checkpoint_id: str | None = None,
     ) -> None:
         super().__init__(*args)
         self.restore = restore
         self.cur_epoch = cur_epoch
+        # the step of `cur_epoch` to resume from, 0 if the epoch is finished
+        self.next_step = next_step
+        # the synchronization period of the epoch being trained, and the one
+        # recommended for the next epoch, carried over to the restarted Lambda
+        self.sync_period = sync_period
+        self.next_sync_period = next_sync_period
+        # the checkpoint saved before the restart, if any
+        self.checkpoint_id = checkpoint_id
@@ -0,0 +1,72 @@
+"""
+Startup profiling of the Lambda handler, enabled by LAMBDA_PROFILE_STARTUP=1.
+
+It records the time to import each module, and the time from the beginning of an
+invocation to its milestones (e.g. the first batch), to track the cold start.
+Only the standard library is used here, since it is imported before everything
+else to see the other imports.
+"""
+import builtins
+import os
+import sys
+import time
+from typing import Any
+
+# the heaviest imports reported
+_TOP_IMPORTS = 20
+
+
+class StartupProfiler:
+    def __init__(self) -> None:
+        self.enabled = os.environ.get("LAMBDA_PROFILE_STARTUP") == "1"
+        self.created_at = time.perf_counter()
+        # the inclusive import time of each module in seconds, reported once
+        self.imports: dict[str, float] = dict()
+        self.invocation_begin: float | None = None
+        self.marks: dict[str, float] = dict()
+        if self.enabled:
+            self._hook_import()
+
+    def _hook_import(self) -> None:
+        original_import = builtins.__import__
+        imports = self.imports
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            if level != 0 or name in sys.modules:
+                return original_import(name, globals, locals, fromlist, level)
+            begin = time.perf_counter()
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                imports.setdefault(name, time.perf_counter() - begin)
+
+        builtins.__import__ = timed_import
+
+    def begin_invocation(self) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.marks = dict()
+        if self.invocation_begin is None:
+            # the initialization of a cold container, since this module is imported
+            self.marks["init"] = now - self.created_at
+        self.invocation_begin = now
+
+    def mark(self, name: str) -> None:
+        """Record a milestone of the invocation, only the first time"""
+        if self.enabled and self.invocation_begin is not None:
+            self.marks.setdefault(name, time.perf_counter() - self.invocation_begin)
+
+    def report(self) -> dict[str, Any] | None:
+        """The imports since the last report and the milestones, in milliseconds"""
+        if not self.enabled:
+            return None
+        imports = sorted(self.imports.items(), key=lambda item: -item[1])
+        self.imports.clear()
+        return {
+            "imports": {name: round(t * 1000, 3) for name, t in imports[:_TOP_IMPORTS]},
+            "marks": {name: round(t * 1000, 3) for name, t in self.marks.items()},
+        }
+
+
+startup_profiler = StartupProfiler()
@@ -0,0 +1,378 @@
+"""
+Binary framing of the gradients exchanged between the workers and the parameter
+server (the `/ps` endpoint).
+
+A frame is laid out as
+
+    | magic (4B) | version (1B) | header length (4B) | header (JSON) | padding | data |
+
+The header records the codec, dtype, shape and offset (relative to the beginning
+of the data section) of every layer, so the receiver can view each layer with
+`np.frombuffer` without any intermediate copy. A layer without gradient is
+recorded as `null`.
+
+Codecs:
+    - "dense": the raw buffer of the layer.
+    - "topk": only the largest-magnitude entries, as flat indices and values.
+
+Any floating buffer of a layer (the dense buffer, or the values of "topk") can
+further be quantized, recorded as "quant" in the header:
+    - "fp16": cast to float16.
+    - "int8": scaled by a per-layer "scale" into [-127, 127], optionally with
+      stochastic rounding. The receiver dequantizes into float32.
+
+Keep this file in sync with `EC2/protocol.py`.
+"""
+import json
+import math
+import struct
+from typing import Any, NamedTuple
+
+import numpy as np
+
+MAGIC = b"SHTP"
+VERSION = 1
+CONTENT_TYPE = "application/octet-stream"
+# the request header to ask the parameter server for a sparse reply
+REPLY_TOPK_HEADER = "X-Reply-Topk-Ratio"
+# the request header to ask the parameter server for a quantized reply
+REPLY_QUANT_HEADER = "X-Reply-Quant"
+QUANT_METHODS = ("fp32", "fp16", "int8")
+# the request header to ask for the stochastic rounding of the quantized reply
+REPLY_STOCHASTIC_HEADER = "X-Reply-Stochastic"
+# the request headers reporting the computation of a worker since its last
+# synchronization, to let the parameter server adapt the synchronization period
+SYNC_STEPS_HEADER = "X-Sync-Steps"
+COMPUTE_TIME_HEADER = "X-Compute-Time"
+# the request header of the target fraction of the time spent on synchronization
+SYNC_OVERHEAD_HEADER = "X-Sync-Overhead"
+# the response header of the recommended synchronization period (in steps)
+SYNC_PERIOD_HEADER = "X-Sync-Period"
+# the request header identifying a worker within its trial, which lets the
+# parameter server tell the rounds of its pushes, e.g. to spot the late ones
+WORKER_ID_HEADER = "X-Worker-Id"
+# the response header set if a push is late for its round, whose result is
+# replied anyway
+SYNC_LATE_HEADER = "X-Sync-Late"
+
+# magic, version, header length
+_PREFIX = struct.Struct("<4sBI")
+# the data section is aligned, so that every layer can be viewed efficiently
+_ALIGNMENT = 64
+# every buffer inside the data section is aligned as well
+_BUFFER_ALIGNMENT = 8
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class SparseGrad(NamedTuple):
+    shape: tuple[int, ...]
+    # indices into the flattened layer, without duplicates
+    indices: np.ndarray
+    values: np.ndarray
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.values.dtype
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros(math.prod(self.shape), dtype=self.values.dtype)
+        dense[self.indices] = self.values
+        return dense.reshape(self.shape)
+
+    def add_to(self, dense: np.ndarray) -> None:
+        """Accumulate the sparse gradient into a contiguous dense array"""
+        dense.reshape(-1)[self.indices] += self.values
+
+
+Grad = np.ndarray | SparseGrad
+
+
+def _align(n: int, alignment: int = _ALIGNMENT) -> int:
+    return (n + alignment - 1) // alignment * alignment
+
+
+def is_frame(data: bytes | bytearray | memoryview) -> bool:
+    return bytes(data[: len(MAGIC)]) == MAGIC
+
+
+def topk(grad: np.ndarray, ratio: float) -> Grad:
+    """Keep the largest-magnitude `ratio` of the entries of a gradient
+    returns:
+        a SparseGrad, or the gradient itself when the sparse form is not smaller
+    """
+    flat = np.ascontiguousarray(grad).reshape(-1)
+    k = max(1, math.ceil(flat.size * ratio))
+    # an entry costs an index and a value
+    if 2 * k >= flat.size:
+        return grad
+    indices = np.argpartition(np.abs(flat), flat.size - k)[flat.size - k :]
+    index_dtype = np.int32 if flat.size <= np.iinfo(np.int32).max else np.int64
+    return SparseGrad(grad.shape, indices.astype(index_dtype), flat[indices])
+
+
+class Quantizer:
+    """Quantize the floating buffers of a frame
+
+    "fp32" keeps the buffers as they are.
+    """
+
+    def __init__(self, method: str, *, stochastic: bool = False) -> None:
+        if method not in QUANT_METHODS:
+            raise ValueError("Unknown quantization method: {}".format(method))
+        self.method = method
+        self.stochastic = stochastic
+        self.rng = np.random.default_rng()
+
+    def quantize(self, array: np.ndarray) -> tuple[np.ndarray, dict[str, Any]]:
+        """
+        returns:
+            the quantized array, and the fields to record in the layer header
+        """
+        if self.method == "fp32" or array.dtype.kind != "f":
+            return array, {}
+        if self.method == "fp16":
+            return array.astype(np.float16), {"quant": "fp16"}
+
+        max_abs = float(np.max(np.abs(array))) if array.size != 0 else 0.0
+        scale = max_abs / 127 if max_abs > 0 else 1.0
+        scaled = array / scale
+        if self.stochastic:
+            # round up with the probability of the fractional part, unbiased
+            scaled = np.floor(scaled + self.rng.random(scaled.shape, np.float32))
+        else:
+            scaled = np.rint(scaled)
+        return np.clip(scaled, -127, 127).astype(np.int8), {
+            "quant": "int8",
+            "scale": scale,
+        }
+
+
+def dequantize(array: np.ndarray, layer: dict[str, Any]) -> np.ndarray:
+    quant = layer.get("quant")
+    if quant is None:
+        return array
+    if quant == "fp16":
+        return array.astype(np.float32)
+    if quant == "int8":
+        return array.astype(np.float32) * np.float32(layer["scale"])
+    raise ProtocolError("Unknown quantization method: {}".format(quant))
+
+
+class TopKCompressor:
+    """Top-k sparsification with error feedback
+
+    The entries that are not sent are kept as a residual, which is added back to
+    the gradient of the next round, so nothing is lost but only delayed.
+    """
+
+    def __init__(self, ratio: float) -> None:
+        if not 0 < ratio <= 1:
+            raise ValueError("The top-k ratio should be in (0, 1]: {}".format(ratio))
+        self.ratio = ratio
+        self.residuals: list[np.ndarray | None] = list()
+
+    def compress(self, grads: list[np.ndarray | None]) -> list[Grad | None]:
+        if len(self.residuals) != len(grads):
+            self.residuals = [None] * len(grads)
+        res: list[Grad | None] = list()
+        for i, grad in enumerate(grads):
+            if grad is None:
+                res.append(None)
+                continue
+            residual = self.residuals[i]
+            acc = np.array(grad) if residual is None else grad + residual
+            sparse = topk(acc, self.ratio)
+            if isinstance(sparse, SparseGrad):
+                # the values are gathered into a new array, so `acc` can be
+                # reused as the residual
+                acc.reshape(-1)[sparse.indices] = 0
+                self.residuals[i] = acc
+            else:
+                self.residuals[i] = None
+            res.append(sparse)
+        return res
+
+
+def encode_grads(grads: list[Grad | None], quantizer: Quantizer | None = None) -> bytes:
+    """Encode a list of gradients into a binary frame
+    args:
+        grads: the gradient of each layer, None if the layer has no gradient
+        quantizer: how to quantize the floating buffers, None to keep them
+    returns:
+        the frame
+    """
+    buffers: list[np.ndarray | bytes] = list()
+    layers: list[dict[str, Any] | None] = list()
+    offset = 0
+
+    def add_buffer(array: np.ndarray) -> int:
+        nonlocal offset
+        if (padding := _align(offset, _BUFFER_ALIGNMENT) - offset) != 0:
+            buffers.append(bytes(padding))
+            offset += padding
+        buffers.append(array)
+        buffer_offset, offset = offset, offset + array.nbytes
+        return buffer_offset
+
+    def quantize(array: np.ndarray) -> tuple[np.ndarray, dict[str, Any]]:
+        array = np.ascontiguousarray(array)
+        if quantizer is None:
+            return array, {}
+        return quantizer.quantize(array)
+
+    for grad in grads:
+        if grad is None:
+            layers.append(None)
+        elif isinstance(grad, SparseGrad):
+            values, quant = quantize(grad.values)
+            indices = np.ascontiguousarray(grad.indices)
+            layers.append(
+                {
+                    "codec": "topk",
+                    "dtype": values.dtype.str,
+                    "shape": list(grad.shape),
+                    "nnz": int(values.size),
+                    "offset": add_buffer(values),
+                    "index_dtype": indices.dtype.str,
+                    "index_offset": add_buffer(indices),
+                    **quant,
+                }
+            )
+        else:
+            data, quant = quantize(grad)
+            layers.append(
+                {
+                    "codec": "dense",
+                    "dtype": data.dtype.str,
+                    "shape": list(grad.shape),
+                    "offset": add_buffer(data),
+                    **quant,
+                }
+            )
+
+    # bytes.join accepts any buffer, so each layer is copied exactly once
+    return b"".join(
+        [
+            _pack_header(layers, offset),
+            *(b if isinstance(b, bytes) else memoryview(b) for b in buffers),
+        ]
+    )
+
+
+def allocate_frame(
+    shapes: list[tuple[int, ...] | None], dtype: np.dtype = np.dtype(np.float32)
+) -> tuple[bytearray, np.ndarray, list[np.ndarray | None]]:
+    """Allocate a zeroed frame of dense layers, to be filled in place
+    The layout is the same as `encode_grads` would produce for such layers.
+    args:
+        shapes: the shape of each layer, None if the layer has no gradient
+    returns:
+        the frame, a flat view of its whole data section (including the padding
+        between the layers) and a view of each layer
+    """
+    layers: list[dict[str, Any] | None] = list()
+    offset = 0
+    for shape in shapes:
+        if shape is None:
+            layers.append(None)
+            continue
+        offset = _align(offset, _BUFFER_ALIGNMENT)
+        layers.append(
+            {
+                "codec": "dense",
+                "dtype": dtype.str,
+                "shape": list(shape),
+                "offset": offset,
+            }
+        )
+        offset += math.prod(shape) * dtype.itemsize
+    header = _pack_header(layers, offset)
+    # the padding after the last layer makes the data section a whole array
+    frame = bytearray(len(header) + _align(offset, dtype.itemsize))
+    frame[: len(header)] = header
+    flat = np.frombuffer(frame, dtype=dtype, offset=len(header))
+    views: list[np.ndarray | None] = list()
+    for layer in layers:
+        if layer is None:
+            views.append(None)
+            continue
+        begin = layer["offset"] // dtype.itemsize
+        end = begin + math.prod(layer["shape"])
+        views.append(flat[begin:end].reshape(layer["shape"]))
+    return frame, flat, views
+
+
+def _pack_header(layers: list[dict[str, Any] | None], nbytes: int) -> bytes:
+    """Pack everything before the data section"""
+    header = json.dumps({"layers": layers, "nbytes": nbytes}).encode("utf-8")
+    prefix = _PREFIX.pack(MAGIC, VERSION, len(header))
+    padding = bytes(_align(len(prefix) + len(header)) - len(prefix) - len(header))
+    return prefix + header + padding
+
+
+def decode_header(frame: bytes | bytearray | memoryview) -> tuple[dict[str, Any], int]:
+    """Parse the header of a frame
+    returns:
+        the header and the position where the data section begins
+    """
+    if len(frame) < _PREFIX.size:
+        raise ProtocolError("The frame is truncated")
+    magic, version, header_length = _PREFIX.unpack_from(frame, 0)
+    if magic != MAGIC:
+        raise ProtocolError("Invalid magic number: {!r}".format(magic))
+    if version != VERSION:
+        raise ProtocolError("Unsupported protocol version: {:d}".format(version))
+    header_end = _PREFIX.size + header_length
+    header = json.loads(bytes(frame[_PREFIX.size : header_end]))
+    data_start = _align(header_end)
+    if len(frame) < data_start + header["nbytes"]:
+        raise ProtocolError("The frame is truncated")
+    return header, data_start
+
+
+def decode_frame(frame: bytes | bytearray | memoryview) -> list[Grad | None]:
+    """Decode a binary frame, keeping the sparse layers sparse
+    The returned arrays share the memory with `frame` unless they are quantized,
+    so they are read-only if `frame` is immutable (e.g. bytes).
+    """
+    header, data_start = decode_header(frame)
+
+    def view(dtype: str, count: int, offset: int) -> np.ndarray:
+        return np.frombuffer(
+            frame, dtype=np.dtype(dtype), count=count, offset=data_start + offset
+        )
+
+    grads: list[Grad | None] = list()
+    for layer in header["layers"]:
+        if layer is None:
+            grads.append(None)
+            continue
+        shape = tuple(layer["shape"])
+        codec = layer.get("codec", "dense")
+        if codec == "dense":
+            data = view(layer["dtype"], math.prod(shape), layer["offset"])
+            grads.append(dequantize(data, layer).reshape(shape))
+        elif codec == "topk":
+            grads.append(
+                SparseGrad(
+                    shape,
+                    view(layer["index_dtype"], layer["nnz"], layer["index_offset"]),
+                    dequantize(
+                        view(layer["dtype"], layer["nnz"], layer["offset"]), layer
+                    ),
+                )
+            )
+        else:
+            raise ProtocolError("Unknown codec: {}".format(codec))
+    return grads
+
+
+def decode_grads(frame: bytes | bytearray | memoryview) -> list[np.ndarray | None]:
+    """Decode a binary frame into a list of dense gradients"""
+    return [
+        grad.to_dense() if isinstance(grad, SparseGrad) else grad
+        for grad in decode_frame(frame)
+    ]
@@ -14,9 +14,23 @@ class LambdaResponse(BaseModel):
     leftTime: NonNegativeFloat = 0.0
     # the epoch that the Lambda has trained
     epoch: int = 0
-    # model weight hex
+    # the step of `epoch` to resume from, 0 to begin the epoch
+    step: int = 0
+    # model weight hex, only if there is no checkpoint store
     weight_hex: str | None = None
+    # the checkpoint to restart from, see `cloud_train.checkpoint`
+    checkpoint_id: str | None = None
+    # the synchronization period of `epoch`, and the one recommended for the next
+    # epoch, if any
+    sync_period: int | None = None
+    next_sync_period: int | None = None
     test_accuracy: str | None = None
+    # the import times and the milestones of the invocation in milliseconds, if
+    # LAMBDA_PROFILE_STARTUP=1
+    startup: dict[str, Any] | None = None
+    # the time of the steps and the synchronizations of the invocation, see
+    # `cloud_train.TrainTelemetry`
+    telemetry: dict[str, Any] | None = None
 
     # def __str__(self) -> str:
     #     return (
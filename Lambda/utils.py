@@ -1,4 +1,5 @@
 import logging
+import math
 import os
 
 import torch
@@ -31,6 +32,9 @@ def set_model_gradients(model, gradients):
 
 def get_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
+    if logger.handlers:
+        # configured already, e.g. by a previous invocation of a warm container
+        return logger
     logger.propagate = False
     stream_handler = logging.StreamHandler()
     stream_handler.setLevel(logging.DEBUG)
@@ -55,20 +59,62 @@ def get_logger(name: str) -> logging.Logger:
 predict_logger = get_logger("utils.predict_restart")
 
 
-def predict_if_restart(cur_epoch: int, remaining_time: int) -> bool:
-    total_time = int(os.environ.get("LAMBDA_TOTAL_TIME")) * 1000  # type: ignore
-    train_time_limit = int(os.environ.get("LAMBDA_TRAIN_LIMIT_TIME")) * 1000  # type: ignore
-    assert train_time_limit <= total_time
-
-    remaining_time -= total_time - train_time_limit
-    spent_percentage = 1 - remaining_time / train_time_limit
-    average_per_epoch = spent_percentage / (cur_epoch + 1)
-    predict_logger.debug(
-        "Predict result: epoch %d, %.4f -> %.4f",
-        cur_epoch,
-        spent_percentage,
-        spent_percentage + average_per_epoch,
-    )
-    if spent_percentage + average_per_epoch >= 1:
-        return True
-    return False
+class RestartPredictor:
+    """Predict whether the next step still fits in the training time limit
+
+    The step time is tracked online by an EWMA of its mean and variance, so a slow
+    step (e.g. with a synchronization) widens the margin instead of overrunning
+    LAMBDA_TOTAL_TIME. The synchronization at the end of an epoch is tracked
+    separately, since it only follows the last step.
+    """
+
+    def __init__(self, alpha: float = 0.2, safety: float = 3.0) -> None:
+        self.alpha = alpha
+        # the number of standard deviations of the margin
+        self.safety = safety
+        self.step_mean: float | None = None
+        self.step_var = 0.0
+        self.sync_mean = 0.0
+        total_time = int(os.environ.get("LAMBDA_TOTAL_TIME")) * 1000  # type: ignore
+        train_time_limit = int(os.environ.get("LAMBDA_TRAIN_LIMIT_TIME")) * 1000  # type: ignore
+        assert train_time_limit <= total_time
+        # the time kept for the checkpoint and the response
+        self.reserved_time = total_time - train_time_limit
+
+    def record_step(self, duration: float) -> None:
+        """
+        args:
+            duration: the time of a step in milliseconds
+        """
+        if self.step_mean is None:
+            self.step_mean = duration
+            return
+        diff = duration - self.step_mean
+        self.step_mean += self.alpha * diff
+        self.step_var = (1 - self.alpha) * (self.step_var + self.alpha * diff * diff)
+
+    def record_sync(self, duration: float) -> None:
+        if self.sync_mean == 0:
+            self.sync_mean = duration
+        else:
+            self.sync_mean += self.alpha * (duration - self.sync_mean)
+
+    def should_restart(self, remaining_time: int, with_sync: bool = False) -> bool:
+        """
+        args:
+            remaining_time: the remaining time of the Lambda in milliseconds
+            with_sync: whether the next step is followed by the synchronization
+        returns:
+            whether to restart before the next step
+        """
+        if self.step_mean is None:
+            # no estimate before the first step, which must be made anyway
+            return False
+        needed = self.step_mean + self.safety * math.sqrt(self.step_var)
+        if with_sync:
+            needed += self.sync_mean
+        available = remaining_time - self.reserved_time
+        predict_logger.debug(
+            "Predict result: %.1f ms needed, %.1f ms available", needed, available
+        )
+        return needed >= available
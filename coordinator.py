@@ -0,0 +1,578 @@
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Literal
+
+import requests
+from pydantic import BaseModel, Field, NonNegativeInt, PositiveFloat, PositiveInt
+
+from local_lambda import LocalLambda
+from models import Hyperparameter
+from scheduler import SlotScheduler
+from worker_model import WorkerModel
+
+logger = logging.getLogger(__name__)
+
+# the time limit of a Lambda invocation in seconds
+TOTAL_TIME_LIMIT = 900
+# @see https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/instancedata-data-retrieval.html
+METADATA_URL = "http://169.254.169.254/latest/meta-data/public-ipv4"
+METADATA_TIMEOUT = 2
+# the timeout of the requests to the parameter server
+PS_TIMEOUT = 10
+# how long a completion report may come after the time limit of the invocation,
+# otherwise the worker is considered lost
+CALLBACK_GRACE = 60
+# the retries of a throttled invocation, with exponential backoff and full jitter
+MAX_THROTTLE_RETRIES = 8
+THROTTLE_BACKOFF_BASE = 1.0
+THROTTLE_BACKOFF_CAP = 60.0
+THROTTLE_ERROR_CODES = ("TooManyRequestsException", "ThrottlingException")
+
+
+def is_throttled(error: Exception) -> bool:
+    """Whether a boto3 error is a throttling, i.e. the invocation did not run"""
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLE_ERROR_CODES
+
+
+class TrialSpec(BaseModel):
+    """A trial, i.e. the settings of `EC2/main.py` on a shared parameter server"""
+
+    trial_id: str
+    # None to choose by the telemetry of the previous trials, see `WorkerModel`
+    worker_number: PositiveInt | None = None
+    function_name: str
+    data_size: PositiveInt
+    epoch: PositiveInt
+    hyperparameter: Hyperparameter
+    # the model trained by the workers, None to use the MODEL_NAME of the function
+    model_name: str | None = None
+    # the trials waiting for the worker slots are admitted by priority, the lowest
+    # first, see `SlotScheduler`
+    priority: float = 0.0
+    # the quorum of the synchronization rounds, see `EC2/global_v.SyncGrad`; the
+    # backup workers are capped to leave at least one worker in the quorum
+    backup_workers: NonNegativeInt = 0
+    round_deadline: PositiveFloat | None = None
+    late_policy: Literal["drop", "next"] = "drop"
+
+
+class TrialResult(BaseModel):
+    trial_id: str
+    worker_number: PositiveInt
+    # the average test accuracy of the workers, 0 for a failed worker
+    accuracy: float
+    # the Lambda time of all the invocations in seconds
+    time: float
+    # the time waiting for the worker slots in seconds
+    queue_time: float = 0.0
+    # the time from the admission to the end of the trial in seconds
+    wall_time: float
+    worker_accuracies: list[float]
+    restarts: NonNegativeInt = 0
+    failed_workers: NonNegativeInt = 0
+    # the time of the steps and the synchronizations of all the workers, see
+    # `cloud_train.TrainTelemetry`
+    telemetry: dict[str, float] = Field(default_factory=dict)
+
+
+class Coordinator:
+    """Run the trials in the process of the search, on a long-lived parameter server
+
+    It is the in-process counterpart of `launch_faastuning.zsh` and `EC2/main.py`:
+    the Lambda client, the validation of the function and the address of the
+    parameter server are set up once by `start`, and every trial only creates its
+    trial on the parameter server and invokes the workers. The trials share a
+    budget of worker slots (see `SlotScheduler`), i.e. the concurrency of the
+    function, and a throttled invocation is retried with jitter.
+
+    The workers are invoked either
+    - "sync": a worker blocks a thread of the coordinator until it returns, or
+    - "event": asynchronously, and a worker reports its response to the callback
+      server of the coordinator (see `cloud_train.report_completion`) when it
+      finishes. The restarts are dispatched from the event loop, so no thread is
+      held while the workers run.
+    - "local": in local processes instead of AWS, see `LocalLambda`. The
+      parameter server is reached on 127.0.0.1.
+    """
+
+    def __init__(
+        self,
+        function_name: str,
+        port: int,
+        *,
+        invocation: Literal["sync", "event", "local"] = "sync",
+        callback_port: int | None = None,
+        max_invocations: int = 256,
+        local_process_number: int = 24,
+        worker_slots: int | None = None,
+        worker_model: WorkerModel | None = None,
+    ) -> None:
+        """
+        args:
+            port: the port of the parameter server
+            callback_port: the port of the callback server, for the event mode
+            max_invocations: the concurrent invocations, i.e. the threads of the
+                sync mode
+            local_process_number: the processes of the local mode
+            worker_slots: the concurrent workers of all the trials, by default the
+                concurrency available to the function (or the processes of the
+                local mode)
+            worker_model: chooses the worker number of the trials without one, and
+                learns from the telemetry of all the trials
+        """
+        if invocation == "event" and callback_port is None:
+            raise ValueError("The event mode needs a callback port")
+        self.function_name = function_name
+        self.port = port
+        self.invocation = invocation
+        self.callback_port = callback_port
+        self.max_invocations = max_invocations
+        self.local_process_number = local_process_number
+        self.worker_slots = worker_slots
+        self.scheduler: SlotScheduler | None = None
+        self.worker_model = worker_model
+        self._lambda_client: Any = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._session = requests.Session()
+        self.instance_ip = "127.0.0.1"
+        # the invocations waiting for their completion reports, by invocation id
+        self._pending: dict[str, asyncio.Future[dict[str, Any]]] = dict()
+        self._callback_server: asyncio.Task[None] | None = None
+        self._callback_shutdown = asyncio.Event()
+        self._local: LocalLambda | None = None
+
+    async def start(self) -> None:
+        if self.invocation == "local":
+            self._executor = ThreadPoolExecutor(thread_name_prefix="ps")
+            self._local = LocalLambda(self.function_name, self.local_process_number)
+            self._local.start()
+            # a process runs one worker at a time
+            slots = self.worker_slots or self.local_process_number
+            self.scheduler = SlotScheduler(min(slots, self.local_process_number))
+            logger.info(
+                "Coordinator started with %d local processes",
+                self.local_process_number,
+            )
+            return
+        # boto3 takes a while to import, and is not needed for the offline search
+        import boto3
+        from botocore.config import Config
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_invocations, thread_name_prefix="invoke"
+        )
+        self._lambda_client = boto3.client(
+            "lambda",
+            config=Config(
+                # a worker replies at the end of its invocation
+                read_timeout=TOTAL_TIME_LIMIT + 60,
+                max_pool_connections=self.max_invocations,
+                # a retry would run the worker twice
+                retries={"max_attempts": 0},
+            ),
+        )
+        await self._run(self._validate_invoke)
+        if (instance_ip := await self._run(self._resolve_instance_ip)) is None:
+            if self.invocation == "event":
+                # the workers would never reach the callback server, and each of
+                # them would be waited for until its deadline
+                raise RuntimeError(
+                    "The public IP of the instance is unknown, so the workers cannot "
+                    'report their completion; use the "sync" or "local" invocation '
+                    "off EC2"
+                )
+            # not on EC2, assume a local test
+            instance_ip = "127.0.0.1"
+        self.instance_ip = instance_ip
+        if self.invocation == "event":
+            await self._run(self._check_event_retries)
+        self.scheduler = SlotScheduler(
+            self.worker_slots or await self._run(self._concurrency_limit)
+        )
+        if self.invocation == "event":
+            await self._start_callback_server()
+        logger.info(
+            "Coordinator started with %d worker slots, parameter server at %s:%d",
+            self.scheduler.slots,
+            self.instance_ip,
+            self.port,
+        )
+
+    async def _start_callback_server(self) -> None:
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config as ServerConfig
+        from quart import Quart, request
+
+        app = Quart(__name__)
+
+        @app.put("/invocations/<invocation_id>")
+        async def complete_invocation(invocation_id: str):
+            if (future := self._pending.get(invocation_id)) is None:
+                return {"error": "Unknown invocation: " + invocation_id}, 404
+            if not future.done():
+                future.set_result(await request.get_json())
+            # a duplicate report is acknowledged as well, so it is not retried
+            return {"invocation-id": invocation_id}
+
+        config = ServerConfig()
+        config.bind = [f"0.0.0.0:{self.callback_port}"]
+        self._callback_shutdown.clear()
+        self._callback_server = asyncio.create_task(
+            serve(app, config, shutdown_trigger=self._callback_shutdown.wait)
+        )
+        # wait until the server accepts the reports
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(
+                    "127.0.0.1", self.callback_port
+                )
+            except OSError:
+                if self._callback_server.done():
+                    self._callback_server.result()
+                    raise RuntimeError("The callback server exits unexpectedly")
+                await asyncio.sleep(0.1)
+            else:
+                writer.close()
+                break
+        logger.info("Callback server started on port %d", self.callback_port)
+
+    async def stop(self) -> None:
+        if self._callback_server is not None:
+            self._callback_shutdown.set()
+            await self._callback_server
+            self._callback_server = None
+        if self._local is not None:
+            self._local.stop()
+            self._local = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._session.close()
+
+    async def _run(self, func, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    def _validate_invoke(self) -> None:
+        """Validate that the function exists and can be invoked, see
+        `EC2/initialize.validate_invoke`
+        """
+        self._lambda_client.get_function(FunctionName=self.function_name)
+        self._lambda_client.invoke(
+            FunctionName=self.function_name,
+            Payload=json.dumps(
+                {
+                    "proxy-url": f"http://127.0.0.1:{self.port}/ps",
+                    "slice-begin": 0,
+                    "slice-end": 128,
+                    "epoch": 1,
+                    "learning-rate": "0.01",
+                    "batch-size": "128",
+                    "momentum": "0.9",
+                    "begin-epoch": 0,
+                }
+            ).encode("utf-8"),
+            InvocationType="DryRun",
+        )
+
+    def _concurrency_limit(self) -> int:
+        """The concurrent executions of the function, reserved or of the account"""
+        res = self._lambda_client.get_function_concurrency(
+            FunctionName=self.function_name
+        )
+        if (reserved := res.get("ReservedConcurrentExecutions")) is not None:
+            return reserved
+        account = self._lambda_client.get_account_settings()
+        return account["AccountLimit"]["UnreservedConcurrentExecutions"]
+
+    def _check_event_retries(self) -> None:
+        """Check that the event invocations of the function are not retried, twice by
+        default, see Lambda/README.md
+        A worker that times out or crashes before its report is counted as failed,
+        so a retry would join the rounds of its trial, or of a deleted trial, again.
+        """
+        try:
+            config = self._lambda_client.get_function_event_invoke_config(
+                FunctionName=self.function_name
+            )
+        except self._lambda_client.exceptions.ResourceNotFoundException:
+            config = dict()
+        if config.get("MaximumRetryAttempts") != 0:
+            raise RuntimeError(
+                "The event invocations of {} are retried by AWS, set "
+                "MaximumRetryAttempts to 0 (see Lambda/README.md) or use the "
+                '"sync" invocation'.format(self.function_name)
+            )
+
+    def _resolve_instance_ip(self) -> str | None:
+        """The public IP of the instance, None if not on EC2"""
+        try:
+            instance_ip = requests.get(METADATA_URL, timeout=METADATA_TIMEOUT).text
+        except requests.RequestException:
+            return None
+        return instance_ip or None
+
+    def _ps_request(self, method: str, path: str, **kwargs) -> requests.Response:
+        return self._session.request(
+            method, f"http://127.0.0.1:{self.port}{path}", timeout=PS_TIMEOUT, **kwargs
+        )
+
+    def _create_trial(self, spec: TrialSpec) -> None:
+        worker_number: int = spec.worker_number  # type: ignore
+        body = {
+            "trial-id": spec.trial_id,
+            "worker-number": worker_number,
+            "backup-workers": min(spec.backup_workers, worker_number - 1),
+            "round-deadline": spec.round_deadline,
+            "late-policy": spec.late_policy,
+        }
+        res = self._ps_request("POST", "/trials", json=body)
+        if res.status_code == 409:
+            # left over by an interrupted search
+            self._delete_trial(spec.trial_id)
+            res = self._ps_request("POST", "/trials", json=body)
+        res.raise_for_status()
+
+    def _delete_trial(self, trial_id: str) -> None:
+        res = self._ps_request("DELETE", f"/trials/{trial_id}")
+        if res.status_code != 200:
+            logger.warning("Fail to delete trial %s: %s", trial_id, res.text)
+
+    def _delete_checkpoint(self, checkpoint_id: str) -> None:
+        try:
+            self._ps_request("DELETE", f"/checkpoints/{checkpoint_id}")
+        except requests.RequestException as e:
+            logger.warning("Fail to delete checkpoint %s: %s", checkpoint_id, e)
+
+    def _invoke(self, payload: dict[str, Any]) -> dict[str, Any]:
+        res = self._lambda_client.invoke(
+            FunctionName=self.function_name,
+            Payload=json.dumps(payload).encode("utf-8"),
+        )
+        return json.loads(res["Payload"].read())
+
+    def _invoke_event(self, payload: dict[str, Any]) -> None:
+        res = self._lambda_client.invoke(
+            FunctionName=self.function_name,
+            Payload=json.dumps(payload).encode("utf-8"),
+            InvocationType="Event",
+        )
+        if res["StatusCode"] != 202:
+            raise RuntimeError(
+                "The invocation is not accepted: {}".format(res["StatusCode"])
+            )
+
+    async def _call_lambda(self, func, payload: dict[str, Any]) -> Any:
+        """Call the Lambda API in the executor, retrying the throttled calls"""
+        for attempt in itertools.count():
+            try:
+                return await self._run(func, payload)
+            except Exception as e:
+                if not is_throttled(e) or attempt >= MAX_THROTTLE_RETRIES:
+                    raise
+                delay = random.uniform(
+                    0, min(THROTTLE_BACKOFF_CAP, THROTTLE_BACKOFF_BASE * 2**attempt)
+                )
+                logger.warning(
+                    "The invocation is throttled, retry in %.2f seconds", delay
+                )
+                await asyncio.sleep(delay)
+
+    async def invoke(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """Invoke a worker once
+        returns:
+            the response of the worker, see `EC2/response.LambdaResponse`
+        """
+        if self._local is not None:
+            return await self._local.invoke(payload)
+        if self.invocation == "sync":
+            return await self._call_lambda(self._invoke, payload)
+
+        invocation_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self._pending[invocation_id] = future
+        try:
+            await self._call_lambda(
+                self._invoke_event,
+                {
+                    **payload,
+                    "callback-url": "http://{}:{}/invocations/{}".format(
+                        self.instance_ip, self.callback_port, invocation_id
+                    ),
+                },
+            )
+            try:
+                return await asyncio.wait_for(future, TOTAL_TIME_LIMIT + CALLBACK_GRACE)
+            except asyncio.TimeoutError:
+                raise RuntimeError(
+                    "No completion is reported by invocation " + invocation_id
+                ) from None
+        finally:
+            del self._pending[invocation_id]
+
+    def worker_payloads(self, spec: TrialSpec) -> list[dict[str, Any]]:
+        """The events of the workers, the same as `EC2/initialize.create_worker` with
+        the default settings
+        """
+        base_url = f"http://{self.instance_ip}:{self.port}"
+        payloads = list()
+        for i in range(spec.worker_number):
+            payloads.append(
+                {
+                    "proxy-url": f"{base_url}/trials/{spec.trial_id}/ps",
+                    "checkpoint-url": f"{base_url}/checkpoints",
+                    "slice-begin": i * spec.data_size // spec.worker_number,
+                    "slice-end": (i + 1) * spec.data_size // spec.worker_number,
+                    "epoch": spec.epoch,
+                    "learning-rate": spec.hyperparameter.learning_rate,
+                    "batch-size": spec.hyperparameter.batch_size,
+                    "momentum": spec.hyperparameter.momentum,
+                    # 0-indexed
+                    "begin-epoch": 0,
+                    "worker-id": i,
+                }
+            )
+            if spec.model_name is not None:
+                payloads[-1]["model-name"] = spec.model_name
+        return payloads
+
+    async def run_worker(self, index: int, payload: dict[str, Any]) -> dict[str, Any]:
+        """Invoke a worker until it finishes, restarting it when it asks to, see
+        `EC2/initialize.invoke_lambda`
+        returns:
+            {"accuracy": ..., "time": ..., "restarts": ..., "error": ...,
+            "telemetry": ...}
+        """
+        trial_id = payload["proxy-url"].rsplit("/", 2)[-2]
+        lambda_time = 0.0
+        restarts = 0
+        accuracy = 0.0
+        error = False
+        telemetry: dict[str, float] = dict()
+        while True:
+            try:
+                response = await self.invoke(payload)
+            except Exception:
+                logger.exception("Trial %s: fail to invoke worker %d", trial_id, index)
+                error = True
+                break
+            lambda_time += TOTAL_TIME_LIMIT - float(response["leftTime"])
+            for key, value in (response.get("telemetry") or {}).items():
+                telemetry[key] = telemetry.get(key, 0) + value
+            if response["error"]:
+                logger.error(
+                    "Trial %s: worker %d fails: %s",
+                    trial_id,
+                    index,
+                    response["errorMessage"],
+                )
+                error = True
+                break
+            if not response["restart"]:
+                accuracy = float(response.get("test_accuracy") or 0)
+                break
+            restarts += 1
+            payload["begin-epoch"] = response["epoch"]
+            payload["begin-step"] = response.get("step", 0)
+            if (sync_period := response.get("sync_period")) is not None:
+                payload["sync-period"] = sync_period
+            payload["next-sync-period"] = response.get("next_sync_period")
+            if (checkpoint_id := response.get("checkpoint_id")) is not None:
+                payload["checkpoint-id"] = checkpoint_id
+            elif (weight_hex := response.get("weight_hex")) is not None:
+                payload["weight_hex"] = weight_hex
+            logger.debug(
+                "Trial %s: worker %d restarts from epoch %d, step %d",
+                trial_id,
+                index,
+                response["epoch"],
+                payload["begin-step"],
+            )
+        if (checkpoint_id := payload.get("checkpoint-id")) is not None:
+            await self._run(self._delete_checkpoint, checkpoint_id)
+        return {
+            "accuracy": accuracy,
+            "time": lambda_time,
+            "restarts": restarts,
+            "error": error,
+            "telemetry": telemetry,
+        }
+
+    async def run_trial(self, spec: TrialSpec) -> TrialResult:
+        """Run a trial on the parameter server
+        A worker that fails counts as 0 accuracy, as `EC2/main.py` does.
+        """
+        if self.scheduler is None:
+            raise RuntimeError("The coordinator is not started")
+        if spec.worker_number is None:
+            if self.worker_model is None:
+                raise ValueError("No worker number for trial " + spec.trial_id)
+            worker_number = self.worker_model.choose(
+                spec.hyperparameter.batch_size,
+                spec.data_size,
+                spec.epoch,
+                self.scheduler.slots,
+                model=spec.model_name,
+                function_name=spec.function_name,
+            )
+            logger.info("Trial %s: choose %d workers", spec.trial_id, worker_number)
+            spec = spec.model_copy(update={"worker_number": worker_number})
+        assert spec.worker_number is not None
+        admission = self.scheduler.admit(spec.worker_number, spec.priority)
+        async with admission as queue_time:
+            logger.info(
+                "Trial %s admitted after %.2f seconds, %d/%d slots in use",
+                spec.trial_id,
+                queue_time,
+                self.scheduler.in_use,
+                self.scheduler.slots,
+            )
+            start = time.perf_counter()
+            await self._run(self._create_trial, spec)
+            try:
+                workers = await asyncio.gather(
+                    *(
+                        self.run_worker(i, payload)
+                        for i, payload in enumerate(self.worker_payloads(spec))
+                    )
+                )
+            finally:
+                await self._run(self._delete_trial, spec.trial_id)
+            wall_time = time.perf_counter() - start
+        accuracies = [worker["accuracy"] for worker in workers]
+        telemetry: dict[str, float] = dict()
+        for worker in workers:
+            for key, value in worker["telemetry"].items():
+                telemetry[key] = telemetry.get(key, 0) + value
+        if self.worker_model is not None and telemetry:
+            self.worker_model.record(
+                spec.hyperparameter.batch_size,
+                spec.worker_number,
+                telemetry,
+                model=spec.model_name,
+                function_name=spec.function_name,
+                data_size=spec.data_size,
+            )
+        result = TrialResult(
+            trial_id=spec.trial_id,
+            worker_number=spec.worker_number,
+            accuracy=math.fsum(accuracies) / len(accuracies),
+            time=math.fsum(worker["time"] for worker in workers),
+            queue_time=queue_time,
+            wall_time=wall_time,
+            worker_accuracies=accuracies,
+            restarts=sum(worker["restarts"] for worker in workers),
+            failed_workers=sum(worker["error"] for worker in workers),
+            telemetry=telemetry,
+        )
+        logger.info("Trial %s finishes: %s", spec.trial_id, result)
+        return result
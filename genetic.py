@@ -1,17 +1,27 @@
 import argparse
 import asyncio
 import csv
+import itertools
 import json
 import logging
+import math
 import random
-from typing import Any
+from typing import Any, Iterable, Iterator
 
 import numpy as np
 from deap import base, creator, tools  # type: ignore
 
 from models import Hyperparameter
+from population import GeneSpace
+from surrogate import GaussianProcess, expected_improvement
 from train import logger as train_logger
-from train import train
+from train import (
+    start_coordinator,
+    start_parameter_server,
+    stop_coordinator,
+    stop_parameter_server,
+    train,
+)
 
 with open("config.json", "r") as f:
     config: dict[str, Any] = json.load(f)
@@ -22,6 +32,28 @@ MATE_PROB: float = config["genetic.mateProb"]
 MAX_EVALUATED_INDIVIDUAL: int = config["genetic.maxEvaluatedIndividual"]
 POPULATION_SIZE: int = config["genetic.population.size"]
 SELECT_SIZE: int = config["genetic.population.selectNumber"]
+SHARED_PARAMETER_SERVER: bool = config["train.sharedParameterServer"]
+# run the trials in this process (on a shared parameter server), instead of a
+# launch script for each trial, see `train.start_coordinator`
+COORDINATOR: bool = config["train.coordinator"]
+# reuse the results of the previous runs, see `train.train`
+RESULT_CACHE: bool = config["train.resultCache"]
+# launch an offspring as soon as any trial finishes, instead of by generations
+STEADY_STATE: bool = config["genetic.steadyState"]
+# multi-fidelity evaluation of the generations: the offspring are trained with
+# the smallest budget (a fraction of the full training) first, and the best 1/eta
+# are promoted to eta times the budget, until the full training
+MIN_BUDGET: float | None = config["genetic.fidelity.minBudget"]
+ETA: int = config["genetic.fidelity.eta"]
+# vary the smallest budget of the generations by Hyperband brackets
+HYPERBAND: bool = config["genetic.fidelity.hyperband"]
+# pre-screen the offspring with a surrogate model: breed this many times the
+# offspring, and only train the most promising ones by the expected improvement
+SURROGATE_FACTOR: int | None = config["genetic.surrogate.candidateFactor"]
+# the full trials needed to fit the surrogate model
+SURROGATE_MIN_HISTORY = 4
+# the attempts to breed an offspring that has not been evaluated
+MAX_BREED_ATTEMPTS = 100
 
 logger = logging.getLogger(__name__)
 logger.propagate = True  # default to be True in fact
@@ -45,6 +77,8 @@ design_space = {
 RANDOM_SEED = np.random.randint(0, 1000)
 np.random.seed(RANDOM_SEED)
 random.seed(RANDOM_SEED)
+# the population engine over the design space, set by `initialize`
+gene_space: GeneSpace
 
 
 def initialize(*, offline_data=None):
@@ -52,78 +86,90 @@ def initialize(*, offline_data=None):
     creator.create(
         "FitnessMin",
         base.Fitness,
-        weights=(-1.0, 0, 0) if offline_data is None else (-1.0, 0),
+        # online: (accuracy, time, cost, budget, worker number, queue time);
+        # offline: (accuracy, time)
+        weights=(-1.0, 0, 0, 0, 0, 0) if offline_data is None else (-1.0, 0),
     )
     # Individual: a list of binaries
-    # `fitness` will become an member of `Individual`
-    creator.create("Individual", list, fitness=creator.FitnessMin)
+    # `fitness` will become an member of `Individual`, and `budget` is the budget
+    # of the fitness (see `record_fitness`), which cannot be read back from the
+    # fitness values of weight 0
+    creator.create("Individual", list, fitness=creator.FitnessMin, budget=1.0)
+
+    # the gene of each dimension is the index of its value, so a dimension can
+    # have any number of values
+    global gene_space
+    gene_space = GeneSpace(
+        [len(values) for values in design_space.values()],
+        np.random.default_rng(RANDOM_SEED),
+    )
 
-    ind_length = [int(np.log2(design_space[key].shape[0])) for key in design_space]
+    def to_individuals(genes: np.ndarray) -> list[creator.Individual]:
+        return [creator.Individual(row) for row in genes.tolist()]
 
     def encode_individual(paras: Hyperparameter) -> creator.Individual:
-        """Encode a hyperparameter into a binary list
+        """Encode a hyperparameter into integer genes
         args:
             paras: a Hyperparameter instance
         returns:
-            a binary list, i.e. list[int]
+            the index of the nearest value of each dimension, i.e. list[int]
         """
-        res = list()
-        for i, key in enumerate(design_space):
-            # idx = np.where(design_space[key] == getattr(paras, key))[0][0]
-            idx = np.argmin(np.abs(design_space[key] - getattr(paras, key)))
-            res.append(list(map(int, np.binary_repr(int(idx), width=ind_length[i]))))
-        return creator.Individual(sum(res, []))
+        return creator.Individual(
+            int(np.argmin(np.abs(values - getattr(paras, key))))
+            for key, values in design_space.items()
+        )
 
     def decode_individual(ind: creator.Individual) -> Hyperparameter:
-        """Decode a binary list into a hyperparameter
+        """Decode integer genes into a hyperparameter
         args:
-            ind: a binary list, i.e. list[int]
+            ind: the index of the value of each dimension, i.e. list[int]
         returns:
             a Hyperparameter instance
         """
-        assert sum(ind_length) == len(ind), "The length of ind is not correct"
-        p = 0
-        params = dict()
-        for i, x in enumerate(ind_length):
-            idx = int("".join(map(str, ind[i : i + x])), 2)
-            params[list(design_space)[i]] = design_space[list(design_space)[i]][idx]
-            p += x
-        return Hyperparameter(**params)
+        assert gene_space.gene_number == len(ind), "The length of ind is not correct"
+        return Hyperparameter(
+            **{key: values[g] for (key, values), g in zip(design_space.items(), ind)}
+        )
 
     def hash_individual(ind: creator.Individual) -> int:
         """Generate an unique hash value for an individual
         args:
-            ind: a binary list, i.e. list[int]
+            ind: the integer genes, i.e. list[int]
         returns:
-            an integer. In fact it's the decimal representation of the binary list
+            an integer. In fact it's the mixed-radix number of the genes
         """
-        return int("".join(map(str, ind)), 2)
+        return int(gene_space.hash(np.asarray(ind))[0])
 
     def hash_decode_individual(key: int) -> creator.Individual:
-        return creator.Individual(map(int, np.binary_repr(key, sum(ind_length))))
+        return to_individuals(gene_space.unhash([key]))[0]
 
     def random_individual() -> creator.Individual:
-        """Generate a random individual
-        returns:
-            a binary list, i.e. list[int]
-        """
-        return creator.Individual(
-            [np.random.randint(0, 2) for _ in range(sum(ind_length))]
-        )
+        return to_individuals(gene_space.random(1))[0]
 
-    def random_population(n: int) -> list[creator.Individual]:
+    def random_population(
+        n: int, excluded: Iterable[int] = ()
+    ) -> list[creator.Individual]:
         """Generate a random population
         args:
             n: the size of population
+            excluded: the hashes not to generate
         returns:
-            a list of binary lists, i.e. list[list[int]]
+            at most n distinct individuals, fewer only if the space is exhausted
         """
-        res: list[creator.Individual] = list()
-        while len(res) < n:
-            ind = random_individual()
-            if len(list(filter(lambda _ind: _ind == ind, res))) == 0:
-                res.append(ind)
-        return res
+        return to_individuals(gene_space.random_unique(n, excluded))
+
+    def mutate_individual(ind: creator.Individual) -> tuple[creator.Individual]:
+        ind[:] = gene_space.mutate(np.asarray([ind]), MUTATION_PROB)[0].tolist()
+        return (ind,)
+
+    def crossover_individuals(
+        ind1: creator.Individual, ind2: creator.Individual
+    ) -> tuple[creator.Individual, creator.Individual]:
+        children1, children2 = gene_space.crossover(
+            np.asarray([ind1]), np.asarray([ind2]), CROSSOVER_PROB
+        )
+        ind1[:], ind2[:] = children1[0].tolist(), children2[0].tolist()
+        return ind1, ind2
 
     def handle_offline_data(path: str) -> dict[int, tuple[float, float]]:
         headers = (*Hyperparameter.model_fields,) + ("accuracy", "time")
@@ -146,15 +192,20 @@ def initialize(*, offline_data=None):
         async def evaluate_individual(
             ind: creator.Individual,
             ind_idx: int,
+            budget: float = 1.0,
         ) -> tuple[float, ...]:
             """Evaluate the fitness of an individual
             args:
                 ind: the individual
+                budget: the fraction of the full training, see `train.fidelity`
             returns:
-                a tuple of fitness value (test accuracy)
+                a tuple of fitness value (test accuracy), the budget, and the trial
+                (see `train.train`)
             """
-            res = await train(decode_individual(ind), ind_idx)
-            return (*res,)
+            accuracy, lambda_time, cost, *trial = await train(
+                decode_individual(ind), ind_idx, use_cache=RESULT_CACHE, budget=budget
+            )
+            return (accuracy, lambda_time, cost, budget, *trial)
 
     else:
         # Use offline data
@@ -173,6 +224,7 @@ def initialize(*, offline_data=None):
             acc = offline_data[hash_individual(ind)]
             return (*acc,)
 
+    toolbox.register("to_individuals", to_individuals)
     toolbox.register("random_individual", random_individual)
     toolbox.register("random_population", random_population)
     toolbox.register("encode_individual", encode_individual)
@@ -180,9 +232,177 @@ def initialize(*, offline_data=None):
     toolbox.register("hash_individual", hash_individual)
     toolbox.register("hash_decode_individual", hash_decode_individual)
     toolbox.register("evaluate", evaluate_individual)
-    toolbox.register("select", tools.selTournament, tournsize=2)
-    toolbox.register("crossover", tools.cxUniform, indpb=CROSSOVER_PROB)
-    toolbox.register("mutate", tools.mutFlipBit, indpb=MUTATION_PROB)
+    toolbox.register("select", select_tournament, tournsize=2)
+    # the same operators as `tools.cxUniform` and `tools.mutFlipBit`, on the genes
+    toolbox.register("crossover", crossover_individuals)
+    toolbox.register("mutate", mutate_individual)
+
+
+def is_full_fidelity(fit: tuple[float, ...]) -> bool:
+    """Whether a fitness is of the full training, see `evaluate_population`"""
+    return len(fit) < 4 or fit[3] == 1.0
+
+
+def fidelity_rank(ind: "creator.Individual") -> tuple[float, base.Fitness]:
+    """Rank an individual by the budget of its fitness first, then by the fitness"""
+    return ind.budget, ind.fitness
+
+
+def select_tournament(
+    individuals: list["creator.Individual"], k: int, tournsize: int
+) -> list["creator.Individual"]:
+    """`tools.selTournament` that never compares the fitness of different budgets
+    The accuracy of a short training is not comparable to that of a longer one.
+    With successive halving, an individual promoted to a larger budget was better
+    than the ones left behind at the budget they share, so it wins, see
+    `fidelity_rank`.
+    """
+    return [
+        max(tools.selRandom(individuals, tournsize), key=fidelity_rank)
+        for _ in range(k)
+    ]
+
+
+def record_fitness(
+    evaluated_history: dict[int, tuple[float, ...]],
+    ind: "creator.Individual",
+    fit: tuple[float, ...],
+) -> None:
+    if (
+        previous_fit := evaluated_history.get(
+            hash_value := toolbox.hash_individual(ind)
+        )
+    ) is not None:
+        logger.critical(
+            "Duplicate trial detected: %d(%s) with fitness %s",
+            toolbox.hash_individual(ind),
+            toolbox.decode_individual(ind),
+            previous_fit,
+        )
+    evaluated_history[hash_value] = fit
+    ind.fitness.values = fit
+    ind.budget = 1.0 if is_full_fidelity(fit) else fit[3]
+    logger.debug("record: (%s), %.4f", toolbox.decode_individual(ind), fit)
+
+
+def rung_budgets(generation: int) -> list[float]:
+    """The budgets of the successive halving rungs of a generation
+    The budgets grow by ETA times up to the full training, from at least
+    MIN_BUDGET. With HYPERBAND, the generations cycle through the brackets, i.e.
+    the smallest budget of each generation is ETA times larger than the previous
+    one, until the full training, then the cycle restarts.
+    returns:
+        the budgets in ascending order, [1.0] if multi-fidelity is disabled
+    """
+    if MIN_BUDGET is None or args.offline_data is not None:
+        return [1.0]
+    # the small epsilon tolerates the rounding of e.g. log(1/27, 3)
+    s_max = max(0, math.floor(math.log(1 / MIN_BUDGET, ETA) + 1e-9))
+    s = s_max - generation % (s_max + 1) if HYPERBAND else s_max
+    return [float(ETA) ** -i for i in range(s, -1, -1)]
+
+
+async def evaluate_population(
+    population: list["creator.Individual"],
+    budgets: list[float],
+    trial_index: Iterator[int],
+    evaluated_history: dict[int, tuple[float, ...]],
+    superseded: list[tuple[float, ...]],
+) -> None:
+    """Evaluate a generation by successive halving
+    The population is trained with the first budget, then the best 1/ETA of each
+    rung is promoted to the next budget, so only the most promising individuals
+    are trained in full.
+    args:
+        budgets: see `rung_budgets`
+        trial_index: the unique indices of the trials
+        superseded: collects the fitness of the rungs replaced by a promotion, which
+            are still paid for
+    """
+    candidates = population
+    for rung, budget in enumerate(budgets):
+        if rung > 0:
+            # the best ones first, see `deap.base.Fitness`
+            candidates = sorted(candidates, key=lambda ind: ind.fitness, reverse=True)
+            candidates = candidates[: max(1, len(candidates) // ETA)]
+            for ind in candidates:
+                superseded.append(evaluated_history.pop(toolbox.hash_individual(ind)))
+        # This step takes a lot of time
+        fitness: list[tuple[float, ...]] = await asyncio.gather(
+            *(toolbox.evaluate(ind, next(trial_index), budget) for ind in candidates)
+        )
+        for ind, fit in zip(candidates, fitness):
+            record_fitness(evaluated_history, ind, fit)
+        if len(budgets) > 1:
+            logger.info(
+                "Rung %d: %d individuals trained with budget %.4f",
+                rung,
+                len(candidates),
+                budget,
+            )
+
+
+def hyperparameter_features(genes: np.ndarray) -> np.ndarray:
+    """The decoded hyperparameters of the genes, scaled to [0, 1] per dimension"""
+    columns = list()
+    for i, values in enumerate(design_space.values()):
+        low, high = values.min(), values.max()
+        columns.append((values[genes[:, i]] - low) / ((high - low) or 1))
+    return np.stack(columns, axis=1)
+
+
+def screen_offspring(
+    candidates: np.ndarray,
+    n: int,
+    evaluated_history: dict[int, tuple[float, ...]],
+    rejected: dict[int, float],
+) -> np.ndarray:
+    """Pick the n most promising candidates by a surrogate model
+    A Gaussian process is fitted on the full trials of the history, and the
+    candidates are ranked by the expected improvement of their fitness. The rest are
+    recorded as rejected, and compete again with the candidates of the later
+    generations, scored by the updated model.
+    args:
+        candidates: the gene matrix of the new offspring
+        rejected: the expected improvement of the rejected candidates by hash,
+            updated in place
+    returns:
+        the gene matrix of at most n offspring, the first n candidates if there is
+        not enough history to fit the model
+    """
+    history = [
+        (key, fit)
+        for key, fit in evaluated_history.items()
+        # the low-fidelity results are not comparable, see `evaluate_population`
+        if is_full_fidelity(fit)
+    ]
+    if len(history) < SURROGATE_MIN_HISTORY:
+        return candidates[:n]
+    candidates = gene_space.unique(
+        np.concatenate([candidates, gene_space.unhash(rejected)]), evaluated_history
+    )
+    if len(candidates) <= n:
+        rejected.clear()
+        return candidates
+
+    # the fitness to maximize, see `deap.base.Fitness.wvalues`
+    weight = creator.FitnessMin.weights[0]
+    y = np.asarray([weight * fit[0] for _, fit in history])
+    model = GaussianProcess().fit(
+        hyperparameter_features(gene_space.unhash(key for key, _ in history)), y
+    )
+    mean, std = model.predict(hyperparameter_features(candidates))
+    improvement = expected_improvement(mean, std, y.max())
+    order = np.argsort(-improvement, kind="stable")
+    keys = gene_space.hash(candidates)
+    rejected.clear()
+    rejected.update((keys[i], float(improvement[i])) for i in order[n:])
+    logger.info(
+        "Screen %d candidates, expected improvement of the chosen: %s",
+        len(candidates),
+        improvement[order[:n]],
+    )
+    return candidates[order[:n]]
 
 
 async def main() -> None:
@@ -190,91 +410,227 @@ async def main() -> None:
     # test whether there are duplicates when adding new offsprings,
     # which truncate repeated trials, saving the time as a result
     evaluated_history: dict[int, tuple[float, ...]] = dict()
+    # the low-fidelity results of the promoted individuals, see
+    # `evaluate_population`
+    superseded: list[tuple[float, ...]] = list()
+    # the offspring not trained, see `screen_offspring`
+    rejected: dict[int, float] = dict()
+    trial_index = itertools.count()
+
+    # a space not larger than the budget is evaluated as a whole
+    exhaustive = gene_space.size <= MAX_EVALUATED_INDIVIDUAL
+    if exhaustive:
+        logger.info("Enumerate all the %d individuals", gene_space.size)
 
     population = toolbox.random_population(POPULATION_SIZE)
-    while len(evaluated_history) < MAX_EVALUATED_INDIVIDUAL:
-        # This step takes a lot of time
-        fitness_task: list[asyncio.Task[tuple[float]]] = list()
-        for i, ind in enumerate(population):
-            fitness_task.append(
-                asyncio.create_task(toolbox.evaluate(ind, i + len(evaluated_history)))
-            )
-        fitness: list[tuple[float, ...]] = await asyncio.gather(*fitness_task)
-        for ind, fit in zip(population, fitness):
-            if (
-                previous_fit := evaluated_history.get(
-                    hash_value := toolbox.hash_individual(ind)
-                )
-            ) is not None:
-                logger.critical(
-                    "Duplicate trial detected: %d(%s) with fitness %s",
-                    toolbox.hash_individual(ind),
-                    toolbox.decode_individual(ind),
-                    previous_fit,
-                )
-            evaluated_history[hash_value] = fit
-            ind.fitness.values = fit
-            logger.debug("record: (%s), %.4f", toolbox.decode_individual(ind), fit)
+    generation = 0
+    while population and len(evaluated_history) < MAX_EVALUATED_INDIVIDUAL:
+        await evaluate_population(
+            population,
+            rung_budgets(generation),
+            trial_index,
+            evaluated_history,
+            superseded,
+        )
+        generation += 1
 
         if len(evaluated_history) >= MAX_EVALUATED_INDIVIDUAL:
             break
 
-        selected_ind = toolbox.select(population, SELECT_SIZE)
-        temp_ind = [toolbox.clone(ind) for ind in selected_ind]
-        # Add more individuals in order to boost the diversity of population
-        temp_ind += toolbox.random_population(POPULATION_SIZE - SELECT_SIZE)
-        for ind in temp_ind:
-            del ind.fitness.values
-            toolbox.mutate(ind)
+        offspring_number = min(
+            POPULATION_SIZE, MAX_EVALUATED_INDIVIDUAL - len(evaluated_history)
+        )
+        candidate_number = offspring_number * (SURROGATE_FACTOR or 1)
+        if exhaustive:
+            offspring = gene_space.random_unique(candidate_number, evaluated_history)
+        else:
+            selected_ind = toolbox.select(population, SELECT_SIZE)
+            parents = np.concatenate(
+                [
+                    np.asarray(selected_ind, dtype=np.int64),
+                    # Add more individuals in order to boost the diversity of
+                    # population
+                    gene_space.random(POPULATION_SIZE - SELECT_SIZE),
+                ]
+            )
+            parents = gene_space.mutate(parents, MUTATION_PROB)
+            offspring = breed_population(parents, candidate_number, evaluated_history)
+        if SURROGATE_FACTOR is not None:
+            offspring = screen_offspring(
+                offspring, offspring_number, evaluated_history, rejected
+            )
+        population[:] = toolbox.to_individuals(offspring)
+
+    report(evaluated_history, superseded)
+    if rejected:
+        logger.info(
+            "rejected by the surrogate: %s",
+            [
+                (toolbox.decode_individual(toolbox.hash_decode_individual(key)), ei)
+                for key, ei in sorted(rejected.items(), key=lambda kv: -kv[1])
+            ],
+        )
 
-        offspring: list[creator.Individual] = list()
 
-        # tool function to check if an individual is duplicated
-        def not_duplicated(
-            ind: creator.Individual,
-        ) -> bool:
-            if toolbox.hash_individual(ind) in evaluated_history:
-                return False
-            for ind2 in offspring:
-                if ind == ind2:
-                    return False
-            return True
-
-        while (
-            len(offspring) + len(evaluated_history) < MAX_EVALUATED_INDIVIDUAL
-            # Possible: len(offspring) == POPULATION_SIZE + 1
-            and len(offspring) < POPULATION_SIZE
-        ):
-            parents = random.sample(temp_ind, 2)
-            parents = list(map(toolbox.clone, parents))
+def breed_population(
+    parents: np.ndarray, n: int, evaluated_history: dict[int, tuple[float, ...]]
+) -> np.ndarray:
+    """Mate random pairs of the parents into n new distinct offspring
+    Each pair is mated with the probability MATE_PROB, and the pairs are drawn in
+    batches until there are enough offspring.
+    args:
+        parents: the gene matrix of the parents
+    returns:
+        the gene matrix of the offspring, topped up with random individuals if the
+        parents do not breed enough
+    """
+    offspring = np.empty((0, gene_space.gene_number), dtype=np.int64)
+    rng = gene_space.rng
+    for _ in range(MAX_BREED_ATTEMPTS):
+        if len(offspring) >= n or len(parents) < 2:
+            break
+        first = rng.integers(0, len(parents), size=n)
+        # the two parents of a pair are different
+        second = (first + rng.integers(1, len(parents), size=n)) % len(parents)
+        mated = rng.random(n) < MATE_PROB
+        children = np.stack(
+            gene_space.crossover(
+                parents[first[mated]], parents[second[mated]], CROSSOVER_PROB
+            ),
+            axis=1,
+        ).reshape(-1, gene_space.gene_number)
+        offspring = gene_space.unique(
+            np.concatenate([offspring, children]), evaluated_history
+        )
+    if len(offspring) < n:
+        offspring = np.concatenate(
+            [
+                offspring,
+                gene_space.random_unique(
+                    n - len(offspring),
+                    [*evaluated_history, *gene_space.hash(offspring)],
+                ),
+            ]
+        )
+    return offspring[:n]
+
+
+def breed_offspring(
+    pool: list["creator.Individual"], excluded: set[int]
+) -> "creator.Individual | None":
+    """Breed an offspring from the evaluated individuals
+    The parents are selected by tournament, mutated, and mated by chance, the same
+    way as a generation does.
+    args:
+        pool: the evaluated individuals
+        excluded: the hashes of the individuals evaluated or in flight
+    returns:
+        None if no new individual is found
+    """
+    for _ in range(MAX_BREED_ATTEMPTS):
+        if len(pool) < 2:
+            candidates = [toolbox.random_individual()]
+        else:
+            candidates = list(map(toolbox.clone, toolbox.select(pool, 2)))
+            for ind in candidates:
+                del ind.fitness.values
+                toolbox.mutate(ind)
             if np.random.rand() < MATE_PROB:
-                new_offspring = toolbox.crossover(*parents)
-                offspring[:] = offspring + list(filter(not_duplicated, new_offspring))
-
-        population[:] = offspring
-
+                candidates = list(toolbox.crossover(*candidates))
+        for ind in candidates:
+            if toolbox.hash_individual(ind) not in excluded:
+                return ind
+    # the neighbourhood of the pool is exhausted, fall back to a random one
+    return next(iter(toolbox.random_population(1, excluded)), None)
+
+
+async def steady_state_main() -> None:
+    """Keep POPULATION_SIZE trials in flight
+    As soon as a trial finishes, it joins the pool (the best POPULATION_SIZE
+    evaluated individuals), and an offspring of the pool is launched, so no
+    concurrency waits on the slowest trial of a generation.
+    """
+    evaluated_history: dict[int, tuple[float, ...]] = dict()
+    pool: list[creator.Individual] = list()
+    in_flight: dict[asyncio.Task[tuple[float, ...]], creator.Individual] = dict()
+    launched = 0
+
+    def launch(ind: creator.Individual) -> None:
+        nonlocal launched
+        task = asyncio.create_task(toolbox.evaluate(ind, launched))
+        in_flight[task] = ind
+        launched += 1
+
+    for ind in toolbox.random_population(
+        min(POPULATION_SIZE, MAX_EVALUATED_INDIVIDUAL)
+    ):
+        launch(ind)
+
+    while in_flight:
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            ind = in_flight.pop(task)
+            record_fitness(evaluated_history, ind, task.result())
+            pool.append(ind)
+            if len(pool) > POPULATION_SIZE:
+                pool.remove(min(pool, key=lambda other: other.fitness))
+
+        while len(in_flight) < POPULATION_SIZE and launched < MAX_EVALUATED_INDIVIDUAL:
+            excluded = {
+                *evaluated_history,
+                *map(toolbox.hash_individual, in_flight.values()),
+            }
+            if (offspring := breed_offspring(pool, excluded)) is None:
+                logger.warning("No new individual can be bred")
+                break
+            launch(offspring)
+
+    report(evaluated_history)
+
+
+def report(
+    evaluated_history: dict[int, tuple[float, ...]],
+    superseded: Iterable[tuple[float, ...]] = (),
+) -> None:
     logger.info("evaluated individual number: %d", len(evaluated_history))
-    logger.info(
-        "evaluated history: %s",
-        list(
-            map(
-                lambda record: (
-                    toolbox.decode_individual(
-                        toolbox.hash_decode_individual(record[0])
-                    ),
-                    record[1],
-                ),
-                sorted(
-                    evaluated_history.items(), key=lambda kv: kv[-1][0], reverse=True
-                ),
-            )
-        ),
+
+    def decode_records(
+        records: Iterable[tuple[int, tuple[float, ...]]]
+    ) -> list[tuple[Hyperparameter, tuple[float, ...]]]:
+        return [
+            (toolbox.decode_individual(toolbox.hash_decode_individual(key)), fit)
+            for key, fit in records
+        ]
+
+    # only the results of the full training are ranked, see `select_tournament`
+    full_history = sorted(
+        ((key, fit) for key, fit in evaluated_history.items() if is_full_fidelity(fit)),
+        key=lambda kv: kv[-1][0],
+        reverse=True,
     )
+    logger.info("evaluated history: %s", decode_records(full_history))
+    if len(full_history) < len(evaluated_history):
+        logger.info(
+            "not promoted to the full training: %s",
+            decode_records(
+                sorted(
+                    (
+                        (key, fit)
+                        for key, fit in evaluated_history.items()
+                        if not is_full_fidelity(fit)
+                    ),
+                    key=lambda kv: (kv[-1][3], kv[-1][0]),
+                    reverse=True,
+                )
+            ),
+        )
+    if full_history:
+        logger.info("best individual: %s", decode_records(full_history[:1])[0])
 
     if args.offline_data is None:
         total_time: float = 0
         total_cost: float = 0
-        for _, t, cost in evaluated_history.values():
+        for _, t, cost, *_ in itertools.chain(evaluated_history.values(), superseded):
             total_time += t
             total_cost += cost
 
@@ -296,8 +652,20 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    # Define the hyperparameter searching space, which need 8 bits to encode
+    # Define the hyperparameter searching space, which has 4 * 16 * 4 individuals
 
     initialize(offline_data=args.offline_data)
 
-    asyncio.run(main())
+    async def run() -> None:
+        try:
+            if args.offline_data is None:
+                if COORDINATOR:
+                    await start_coordinator()
+                elif SHARED_PARAMETER_SERVER:
+                    await start_parameter_server()
+            await (steady_state_main() if STEADY_STATE else main())
+        finally:
+            await stop_coordinator()
+            await stop_parameter_server()
+
+    asyncio.run(run())
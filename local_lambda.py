@@ -0,0 +1,150 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Lambda")
+# the environment of the deployed function, see Lambda/prepare_ev.zsh
+DEFAULT_ENVIRONMENT = {
+    "LAMBDA_TOTAL_TIME": "900",
+    "LAMBDA_TRAIN_LIMIT_TIME": "200",
+}
+
+
+class InvocationTimeout(BaseException):
+    """Raised in the handler at the deadline, as AWS would stop the invocation"""
+
+
+class LocalContext:
+    """The context of a local invocation, whose deadline is enforced by `run_handler`"""
+
+    def __init__(self, function_name: str, time_limit: float) -> None:
+        self.function_name = function_name
+        self._deadline = time.monotonic() + time_limit
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+def _init_process(cpus: "multiprocessing.Queue[set[int]]") -> None:
+    """Set up a worker process like a Lambda container of the function"""
+    os.chdir(LAMBDA_DIR)
+    sys.path.insert(0, LAMBDA_DIR)
+    for key, value in DEFAULT_ENVIRONMENT.items():
+        os.environ.setdefault(key, value)
+    cpu_set = cpus.get()
+    if cpu_set and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_set)
+    # torch is imported later, and sizes its thread pool by this
+    os.environ.setdefault("OMP_NUM_THREADS", str(max(1, len(cpu_set))))
+
+
+# whether the alarm of the current invocation fired, see `run_handler`
+_timed_out = False
+
+
+def _on_timeout(signum, frame) -> None:
+    global _timed_out
+    _timed_out = True
+    raise InvocationTimeout()
+
+
+def run_handler(
+    event: dict[str, Any], function_name: str, time_limit: float
+) -> dict[str, Any]:
+    """Invoke `Lambda/app.handler` in a worker process
+    The process is kept by the pool, so the later invocations are warm, with the
+    modules and the runtime cache of the previous ones.
+    """
+    global _timed_out
+    import app  # type: ignore
+
+    _timed_out = False
+    signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, time_limit)
+    try:
+        response = app.handler(event, LocalContext(function_name, time_limit))
+    except InvocationTimeout:
+        pass
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    # the handler catches any exception, the timeout included, and returns a
+    # generic error instead
+    if _timed_out:
+        return {
+            "restart": False,
+            "error": True,
+            "errorMessage": "Task timed out after {:.2f} seconds".format(time_limit),
+            "leftTime": 0.0,
+        }
+    return response
+
+
+class LocalLambda:
+    """Run the Lambda function in a pool of local processes, e.g. to benchmark the
+    parameter server, the restarts or the search without AWS
+
+    Each process is pinned to its own CPUs, and hosts one invocation at a time, so
+    the process number must cover the concurrent workers: the workers of a trial
+    wait for each other at the parameter server.
+    """
+
+    def __init__(
+        self,
+        function_name: str,
+        process_number: int,
+        *,
+        time_limit: float = 900,
+        cpus_per_process: int = 1,
+    ) -> None:
+        self.function_name = function_name
+        self.process_number = process_number
+        self.time_limit = time_limit
+        self.cpus_per_process = cpus_per_process
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self) -> None:
+        # a fresh interpreter like a cold container, and torch is not fork-safe
+        context = multiprocessing.get_context("spawn")
+        cpus: multiprocessing.Queue[set[int]] = context.Queue()
+        available = (
+            sorted(os.sched_getaffinity(0))
+            if hasattr(os, "sched_getaffinity")
+            else list()
+        )
+        for i in range(self.process_number):
+            # the CPUs are shared round-robin if there are not enough of them
+            cpus.put(
+                {
+                    available[(i * self.cpus_per_process + j) % len(available)]
+                    for j in range(self.cpus_per_process)
+                }
+                if available
+                else set()
+            )
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.process_number,
+            mp_context=context,
+            initializer=_init_process,
+            initargs=(cpus,),
+        )
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def invoke(self, event: dict[str, Any]) -> dict[str, Any]:
+        """Invoke the function synchronously
+        returns:
+            the response of the handler, see `EC2/response.LambdaResponse`
+        """
+        if self._executor is None:
+            raise RuntimeError("The local Lambda is not started")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, run_handler, event, self.function_name, self.time_limit
+        )
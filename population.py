@@ -0,0 +1,133 @@
+import math
+from typing import Iterable, Sequence
+
+import numpy as np
+
+# the spaces up to this size are hashed with int64 arithmetic
+_INT64_SPACE = 2**62
+
+
+class GeneSpace:
+    """A population engine over integer genes
+
+    An individual is a row of a 2-D gene matrix, whose gene i is an index into the
+    i-th dimension of the design space, in [0, cardinalities[i]). So a dimension
+    can have any number of values, unlike a binary encoding. The operators work on
+    the whole matrix at once.
+
+    The hash of an individual is its mixed-radix number, which is unique and can be
+    decoded back (see `unhash`).
+    """
+
+    def __init__(
+        self, cardinalities: Sequence[int], rng: np.random.Generator | None = None
+    ) -> None:
+        if any(c < 1 for c in cardinalities):
+            raise ValueError(
+                "A gene needs at least one value: {}".format(cardinalities)
+            )
+        self.cardinalities = np.asarray(cardinalities, dtype=np.int64)
+        self.size = math.prod(int(c) for c in cardinalities)
+        # the weight of each gene in the hash, the last gene varies fastest
+        weights = [1] * len(cardinalities)
+        for i in range(len(cardinalities) - 2, -1, -1):
+            weights[i] = weights[i + 1] * int(cardinalities[i + 1])
+        self._weights = weights
+        self._int64_weights = (
+            np.asarray(weights, dtype=np.int64) if self.size < _INT64_SPACE else None
+        )
+        self.rng = rng or np.random.default_rng()
+
+    @property
+    def gene_number(self) -> int:
+        return len(self.cardinalities)
+
+    def hash(self, genes: np.ndarray) -> np.ndarray:
+        """The hash of each row
+        returns:
+            int64 if the space allows, otherwise Python ints (dtype object)
+        """
+        genes = np.atleast_2d(genes)
+        if self._int64_weights is not None:
+            return genes.astype(np.int64) @ self._int64_weights
+        return np.array(
+            [sum(int(g) * w for g, w in zip(row, self._weights)) for row in genes],
+            dtype=object,
+        )
+
+    def unhash(self, keys: Iterable[int]) -> np.ndarray:
+        rows = list()
+        for key in keys:
+            key = int(key)
+            row = list()
+            for w in self._weights:
+                g, key = divmod(key, w)
+                row.append(g)
+            rows.append(row)
+        return np.asarray(rows, dtype=np.int64).reshape(-1, self.gene_number)
+
+    def random(self, n: int) -> np.ndarray:
+        return self.rng.integers(
+            0, self.cardinalities, size=(n, self.gene_number), dtype=np.int64
+        )
+
+    def enumerate(self) -> np.ndarray:
+        """Every individual of the space, in the order of the hash"""
+        return self.unhash(range(self.size))
+
+    def unique(self, genes: np.ndarray, excluded: Iterable[int] = ()) -> np.ndarray:
+        """Drop the duplicated rows and the excluded hashes, keeping the order"""
+        if len(genes) == 0:
+            return genes
+        keys = self.hash(genes)
+        if keys.dtype == object:
+            seen = set(excluded)
+            mask = np.zeros(len(keys), dtype=bool)
+            for i, key in enumerate(keys):
+                if key not in seen:
+                    seen.add(key)
+                    mask[i] = True
+            return genes[mask]
+        _, first = np.unique(keys, return_index=True)
+        mask = np.zeros(len(keys), dtype=bool)
+        mask[first] = True
+        excluded = np.fromiter(excluded, dtype=np.int64)
+        if len(excluded) != 0:
+            mask &= ~np.isin(keys, excluded)
+        return genes[mask]
+
+    def random_unique(self, n: int, excluded: Iterable[int] = ()) -> np.ndarray:
+        """At most n distinct random rows, none of which is excluded"""
+        excluded = set(excluded)
+        available = self.size - len(excluded)
+        if available <= n:
+            return self.unique(self.enumerate(), excluded)
+        res = np.empty((0, self.gene_number), dtype=np.int64)
+        while len(res) < n:
+            # oversample, as some rows are duplicated or excluded
+            batch = self.random(2 * (n - len(res)) + 8)
+            res = self.unique(np.concatenate([res, batch]), excluded)
+        return res[:n]
+
+    def mutate(self, genes: np.ndarray, indpb: float) -> np.ndarray:
+        """Change each gene with the probability, to another value of the gene
+        Like flipping a bit, a mutated gene never keeps its value.
+        """
+        genes = np.array(genes, dtype=np.int64)
+        mask = (self.rng.random(genes.shape) < indpb) & (self.cardinalities > 1)
+        shift = self.rng.integers(
+            1, np.maximum(self.cardinalities, 2), size=genes.shape
+        )
+        genes[mask] = ((genes + shift) % self.cardinalities)[mask]
+        return genes
+
+    def crossover(
+        self, parents1: np.ndarray, parents2: np.ndarray, indpb: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Uniform crossover of each pair of rows
+        Each gene is swapped with the probability.
+        """
+        mask = self.rng.random(parents1.shape) < indpb
+        children1 = np.where(mask, parents2, parents1)
+        children2 = np.where(mask, parents1, parents2)
+        return children1, children2
@@ -0,0 +1,81 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+class SlotScheduler:
+    """A global budget of worker slots, shared by the trials
+
+    A trial holds a slot for each of its workers, from its admission to its end,
+    since the workers of a trial wait for each other at the parameter server. The
+    trials waiting for slots are admitted by priority (the lowest first), then in
+    the order they arrive. The head of the queue is never overtaken, so a large
+    trial is not starved by the smaller ones behind it.
+    """
+
+    def __init__(self, slots: int) -> None:
+        if slots < 1:
+            raise ValueError("The slot number must be positive: {}".format(slots))
+        self.slots = slots
+        self.in_use = 0
+        self._waiters: list[tuple[float, int, int, asyncio.Future[None]]] = list()
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(not future.done() for *_, future in self._waiters)
+
+    def _dispatch(self) -> None:
+        while self._waiters:
+            _, _, n, future = self._waiters[0]
+            if future.done():
+                # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_use + n > self.slots:
+                break
+            heapq.heappop(self._waiters)
+            self.in_use += n
+            future.set_result(None)
+
+    async def acquire(self, n: int, priority: float = 0.0) -> None:
+        if n > self.slots:
+            raise ValueError(
+                "{} slots are asked, more than the budget {}".format(n, self.slots)
+            )
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), n, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # admitted just before the cancellation
+                self.release(n)
+            else:
+                future.cancel()
+                self._dispatch()
+            raise
+
+    def release(self, n: int) -> None:
+        self.in_use -= n
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def admit(self, n: int, priority: float = 0.0) -> AsyncIterator[float]:
+        """Hold n slots in the context
+        yields:
+            the time waited in the queue in seconds
+        """
+        begin = time.perf_counter()
+        await self.acquire(n, priority)
+        try:
+            yield time.perf_counter() - begin
+        finally:
+            self.release(n)
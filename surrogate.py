@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+
+
+class GaussianProcess:
+    """A Gaussian process regressor with a squared exponential kernel
+
+    The features are expected in [0, 1] per dimension, and the targets are
+    standardized before fitting, so the fixed length scale and noise suit any
+    objective. It is only meant for the small histories of a search, as fitting
+    solves a dense linear system of the history size.
+    """
+
+    def __init__(self, length_scale: float = 0.25, noise: float = 1e-2) -> None:
+        self.length_scale = length_scale
+        self.noise = noise
+        self._x: np.ndarray | None = None
+
+    def _kernel(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        sq_dist = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=-1)
+        return np.exp(-0.5 * sq_dist / self.length_scale**2)
+
+    def fit(self, x: np.ndarray, y: np.ndarray) -> "GaussianProcess":
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self._y_mean = y.mean()
+        self._y_std = y.std() or 1.0
+        k = self._kernel(x, x) + self.noise * np.eye(len(x))
+        self._chol = np.linalg.cholesky(k)
+        self._alpha = np.linalg.solve(
+            self._chol.T, np.linalg.solve(self._chol, (y - self._y_mean) / self._y_std)
+        )
+        self._x = x
+        return self
+
+    def predict(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        returns:
+            the posterior mean and standard deviation of each row
+        """
+        assert self._x is not None, "The model is not fitted"
+        k = self._kernel(np.asarray(x, dtype=np.float64), self._x)
+        mean = k @ self._alpha
+        v = np.linalg.solve(self._chol, k.T)
+        var = np.maximum(1.0 - (v**2).sum(axis=0), 0.0)
+        return mean * self._y_std + self._y_mean, np.sqrt(var) * self._y_std
+
+
+_erf = np.vectorize(math.erf, otypes=[np.float64])
+
+
+def expected_improvement(
+    mean: np.ndarray, std: np.ndarray, best: float, xi: float = 0.01
+) -> np.ndarray:
+    """The expected improvement over the best target so far, to be maximized
+    args:
+        xi: the margin of the improvement, which favors exploration
+    """
+    improvement = mean - best - xi
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, improvement / std, 0.0)
+    cdf = 0.5 * (1 + _erf(z / math.sqrt(2)))
+    pdf = np.exp(-0.5 * z**2) / math.sqrt(2 * math.pi)
+    return np.where(
+        std > 0, improvement * cdf + std * pdf, np.maximum(improvement, 0.0)
+    )
@@ -2,10 +2,15 @@ import asyncio
 import hashlib
 import json
 import logging
+import math
+import os
 import pathlib
 from typing import Any
 
+from coordinator import Coordinator, TrialSpec
 from models import Hyperparameter
+from trial_cache import TrialCache
+from worker_model import WorkerModel
 
 logger = logging.getLogger(__name__)
 logger.propagate = True  # default to be True in fact
@@ -21,23 +26,210 @@ stream_handler.setFormatter(
 logger.addHandler(stream_handler)
 
 
+# the port of the long-lived parameter server, i.e. the default of EC2 settings
+SHARED_PS_PORT = 8080
+_shared_ps: asyncio.subprocess.Process | None = None
+
+# the training settings of every trial
+WORKER_NUMBER = 4
+# choose the worker number of each trial by the telemetry of the previous ones,
+# instead of WORKER_NUMBER, see `WorkerModel`; only with the coordinator
+ADAPTIVE_WORKERS = os.environ.get("FAASTUNING_ADAPTIVE_WORKERS") == "1"
+# what the worker number minimizes: "time" | "cost"
+WORKER_OBJECTIVE = os.environ.get("FAASTUNING_WORKER_OBJECTIVE", "time")
+TELEMETRY_PATH = "output/telemetry.jsonl"
+# the workers a synchronization round does not wait for, and the seconds after
+# which a round finishes anyway; only with the coordinator, see `EC2/global_v.SyncGrad`
+BACKUP_WORKERS = int(os.environ.get("FAASTUNING_BACKUP_WORKERS", 0))
+ROUND_DEADLINE = (
+    float(os.environ["FAASTUNING_ROUND_DEADLINE"])
+    if os.environ.get("FAASTUNING_ROUND_DEADLINE")
+    else None
+)
+# the grads pushed after their round finishes: "drop" | "next"
+LATE_POLICY = os.environ.get("FAASTUNING_LATE_POLICY", "drop")
+FUNCTION_NAME = "new-hyperparameter-tuning"
+# the model trained by the workers, sent with every trial if set; unset to use the
+# MODEL_NAME of the function, which the search cannot see
+MODEL_NAME = os.environ.get("FAASTUNING_MODEL_NAME") or None
+DATA_SIZE = 60000
+EPOCH = 2
+# how the coordinator invokes the workers: "event" | "sync" | "local", see
+# `Coordinator`
+INVOCATION = os.environ.get("FAASTUNING_INVOCATION", "sync")
+# the processes of the "local" invocation, which must cover the concurrent workers
+LOCAL_PROCESS_NUMBER = int(os.environ.get("FAASTUNING_LOCAL_PROCESSES", 24))
+# the concurrent workers of all the trials, unset to use the concurrency available
+# to the function, see `Coordinator`
+WORKER_SLOTS = os.environ.get("FAASTUNING_WORKER_SLOTS")
+# where the workers report their completion in the event mode
+CALLBACK_PORT = 8070
+# the durable results of the trials, see `TrialCache`
+RESULT_CACHE_PATH = "output/trials.sqlite3"
+_trial_cache: TrialCache | None = None
+# runs the trials in this process instead of launch_faastuning.zsh, see
+# `start_coordinator`
+_coordinator: Coordinator | None = None
+
+
+async def start_parameter_server() -> None:
+    """Start a long-lived parameter server, which hosts the trials started later
+    instead of a parameter server for each trial.
+    """
+    global _shared_ps
+    log_file = open("EC2/log/server_shared.log", "w")
+    _shared_ps = await asyncio.create_subprocess_exec(
+        "python3",
+        "EC2/server.py",
+        stdout=log_file,
+        stderr=log_file,
+    )
+    log_file.close()
+    # wait until the server accepts connections
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", SHARED_PS_PORT)
+        except OSError:
+            if _shared_ps.returncode is not None:
+                raise RuntimeError("The parameter server exits unexpectedly")
+            await asyncio.sleep(0.2)
+        else:
+            writer.close()
+            break
+    logger.info("Parameter server started on port %d", SHARED_PS_PORT)
+
+
+async def stop_parameter_server() -> None:
+    global _shared_ps
+    if _shared_ps is None:
+        return
+    _shared_ps.terminate()
+    await _shared_ps.wait()
+    _shared_ps = None
+
+
+async def start_coordinator() -> None:
+    """Run the trials in this process, on a long-lived parameter server
+    It saves the startup of the interpreters, the Lambda client and the validation
+    of the function for every trial.
+    """
+    global _coordinator
+    if _shared_ps is None:
+        await start_parameter_server()
+    _coordinator = Coordinator(
+        FUNCTION_NAME,
+        SHARED_PS_PORT,
+        invocation=INVOCATION,  # type: ignore
+        callback_port=CALLBACK_PORT,
+        local_process_number=LOCAL_PROCESS_NUMBER,
+        worker_slots=None if WORKER_SLOTS is None else int(WORKER_SLOTS),
+        worker_model=WorkerModel(
+            default=WORKER_NUMBER,
+            objective=WORKER_OBJECTIVE,  # type: ignore
+            path=TELEMETRY_PATH,
+        ),
+    )
+    await _coordinator.start()
+
+
+async def stop_coordinator() -> None:
+    global _coordinator
+    if _coordinator is None:
+        return
+    await _coordinator.stop()
+    _coordinator = None
+
+
 def hash_hyperparameter(params: Hyperparameter) -> str:
     m = hashlib.sha1()
     m.update(str(params).encode())
     return m.hexdigest()
 
 
-async def train(params: Hyperparameter, index: int) -> tuple[float, ...]:
+def fidelity(budget: float) -> tuple[int, int]:
+    """The epochs and the data size of a fraction of the full training
+    args:
+        budget: the fraction of the samples trained, i.e. EPOCH * DATA_SIZE in full,
+            which are spent in as many epochs as possible
+    """
+    epoch = max(1, min(EPOCH, math.floor(budget * EPOCH)))
+    return epoch, min(DATA_SIZE, round(budget * EPOCH * DATA_SIZE / epoch))
+
+
+def trial_settings(epoch: int, data_size: int) -> dict[str, Any]:
+    """The settings that a trial result depends on besides the hyperparameter"""
+    settings: dict[str, Any] = {
+        "worker-number": (
+            "adaptive"
+            if ADAPTIVE_WORKERS and _coordinator is not None
+            else WORKER_NUMBER
+        ),
+        "function-name": FUNCTION_NAME,
+        "data-size": data_size,
+        "epoch": epoch,
+        # the search cannot see the default model of the function, so those
+        # results are keyed as the default of the function above, never as a model
+        "model": MODEL_NAME or "function-default",
+    }
+    if _coordinator is not None and (BACKUP_WORKERS or ROUND_DEADLINE is not None):
+        # a round without the stragglers trains on other grads
+        settings["quorum"] = {
+            "backup-workers": BACKUP_WORKERS,
+            "round-deadline": ROUND_DEADLINE,
+            "late-policy": LATE_POLICY,
+        }
+    return settings
+
+
+async def train(
+    params: Hyperparameter,
+    index: int,
+    *,
+    use_cache: bool = True,
+    budget: float = 1.0,
+) -> tuple[float, ...]:
+    """Train with a hyperparameter, unless the result is cached or being trained
+    args:
+        budget: the fidelity of the training, see `fidelity`
+    returns:
+        (accuracy, time, cost, worker number, queue time), all 0 if the training
+        fails; the worker number is the one chosen for the trial (see
+        `WorkerModel`), and the queue time is the time waiting for the worker slots
+    """
+    global _trial_cache
+    epoch, data_size = fidelity(budget)
+    if not use_cache:
+        result = await run_trial(params, index, epoch, data_size)
+    else:
+        if _trial_cache is None:
+            _trial_cache = TrialCache(RESULT_CACHE_PATH)
+        result = await _trial_cache.get(
+            hash_hyperparameter(params),
+            params,
+            trial_settings(epoch, data_size),
+            lambda: run_trial(params, index, epoch, data_size),
+        )
+    if result is None:
+        return (0.0, 0.0, 0.0, 0, 0.0)
+    # cached before the worker number was recorded, which is unknown then
+    return (*result, 0, 0.0) if len(result) == 3 else result
+
+
+async def run_trial(
+    params: Hyperparameter, index: int, epoch: int, data_size: int
+) -> tuple[float, ...] | None:
+    if _coordinator is not None:
+        return await run_coordinated_trial(params, index, epoch, data_size)
     output_file = pathlib.Path("output/" + str(index) + ".txt")
     log_output = pathlib.Path("subprocess/" + str(index) + ".txt")
     command: list[str] = [
         "zsh",
         "launch_faastuning.zsh",
-        "4",  # worker number
-        "new-hyperparameter-tuning",  # function name
-        "60000",  # data size
-        "2",  # epoch
-        f"{10000+index}",  # port
+        str(WORKER_NUMBER),
+        FUNCTION_NAME,
+        str(data_size),
+        str(epoch),
+        f"{10000+index if _shared_ps is None else SHARED_PS_PORT}",  # port
         str(index),
         str(params.batch_size),
         str(params.momentum),
@@ -48,6 +240,10 @@ async def train(params: Hyperparameter, index: int) -> tuple[float, ...]:
         *command,
         stdout=log_file,
         stderr=log_file,
+        env={
+            **os.environ,
+            "FAASTUNING_SHARED_PS": "0" if _shared_ps is None else "1",
+        },
     )
     logger.info("Create process with command: %s", " ".join(command))
     await proc.wait()
@@ -64,9 +260,39 @@ async def train(params: Hyperparameter, index: int) -> tuple[float, ...]:
         logger.info("Train (%s) over with result %s", params, res)
     except Exception:
         logger.exception("Train (%s) failed", params)
-        return (0.0, 0.0, 0.0)
+        return None
     else:
-        return (*map(float, res), 0)
+        return (*map(float, res), 0, WORKER_NUMBER, 0.0)
+
+
+async def run_coordinated_trial(
+    params: Hyperparameter, index: int, epoch: int, data_size: int
+) -> tuple[float, ...] | None:
+    assert _coordinator is not None, "The coordinator is not started"
+    try:
+        result = await _coordinator.run_trial(
+            TrialSpec(
+                # the same as launch_faastuning.zsh
+                trial_id=f"trial_{index}",
+                worker_number=None if ADAPTIVE_WORKERS else WORKER_NUMBER,
+                function_name=FUNCTION_NAME,
+                data_size=data_size,
+                epoch=epoch,
+                hyperparameter=params,
+                model_name=MODEL_NAME,
+                # the longer trials first, e.g. the promoted ones of successive
+                # halving, so they do not straggle at the end of a generation
+                priority=-epoch * data_size,
+                backup_workers=BACKUP_WORKERS,
+                round_deadline=ROUND_DEADLINE,
+                late_policy=LATE_POLICY,
+            )
+        )
+    except Exception:
+        logger.exception("Train (%s) failed", params)
+        return None
+    logger.info("Train (%s) over with result %s", params, result)
+    return (result.accuracy, result.time, 0, result.worker_number, result.queue_time)
 
 
 async def main():
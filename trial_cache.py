@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from models import Hyperparameter
+
+logger = logging.getLogger(__name__)
+
+# the interval to poll a trial run by another process
+POLL_INTERVAL = 5.0
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TrialCache:
+    """A durable store of the trial results, shared by the runs of the search
+
+    A trial is keyed by the hash of its hyperparameter and the training settings,
+    so the results of a crashed or re-run search are reused. The concurrent
+    requests for the same trial are coalesced onto one run: within a process by
+    sharing the future, and across processes by claiming the trial in SQLite, with
+    the others polling until it finishes (or the claiming process dies).
+    SQLite blocks for up to its timeout on a lock, so it is queried off the event
+    loop, one thread at a time.
+    """
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        # autocommit, the transactions are explicit
+        self.conn = sqlite3.connect(
+            path, isolation_level=None, timeout=30, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS trials (
+                key TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                settings TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                pid INTEGER,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.in_flight: dict[str, asyncio.Future[tuple[float, ...]]] = dict()
+
+    @staticmethod
+    def key(hyperparameter_hash: str, settings: dict[str, Any]) -> str:
+        return "{}:{}".format(hyperparameter_hash, json.dumps(settings, sort_keys=True))
+
+    def _claim(
+        self, key: str, params: Hyperparameter, settings: dict[str, Any]
+    ) -> tuple[float, ...] | bool:
+        """
+        returns:
+            the result if it is done, otherwise whether the trial is claimed
+        """
+        with self._lock:
+            return self._claim_locked(key, params, settings)
+
+    def _claim_locked(
+        self, key: str, params: Hyperparameter, settings: dict[str, Any]
+    ) -> tuple[float, ...] | bool:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT status, result, pid FROM trials WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                status, result, pid = row
+                if status == "done":
+                    return tuple(json.loads(result))
+                if pid != os.getpid() and _pid_alive(pid):
+                    return False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, 'running', NULL, ?, ?)",
+                (
+                    key,
+                    params.model_dump_json(),
+                    json.dumps(settings, sort_keys=True),
+                    os.getpid(),
+                    time.time(),
+                ),
+            )
+            return True
+        finally:
+            self.conn.execute("COMMIT")
+
+    def _finish(self, key: str, result: tuple[float, ...] | None) -> None:
+        """Record the result, or release the claim if the trial failed"""
+        with self._lock:
+            if result is None:
+                self.conn.execute(
+                    "DELETE FROM trials WHERE key = ? AND pid = ?", (key, os.getpid())
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE trials SET status = 'done', result = ?, updated = ? "
+                    "WHERE key = ?",
+                    (json.dumps(result), time.time(), key),
+                )
+
+    async def _run(
+        self,
+        key: str,
+        params: Hyperparameter,
+        settings: dict[str, Any],
+        run: Callable[[], Awaitable[tuple[float, ...] | None]],
+    ) -> tuple[float, ...] | None:
+        while True:
+            claimed = await asyncio.to_thread(self._claim, key, params, settings)
+            if isinstance(claimed, tuple):
+                logger.info("Reuse the result of (%s): %s", params, claimed)
+                return claimed
+            if claimed:
+                break
+            logger.debug("(%s) is run by another process, wait for it", params)
+            await asyncio.sleep(POLL_INTERVAL)
+        result = None
+        try:
+            result = await run()
+        finally:
+            await asyncio.to_thread(self._finish, key, result)
+        return result
+
+    async def get(
+        self,
+        hyperparameter_hash: str,
+        params: Hyperparameter,
+        settings: dict[str, Any],
+        run: Callable[[], Awaitable[tuple[float, ...] | None]],
+    ) -> tuple[float, ...] | None:
+        """The result of a trial, run only if no one has it or is running it
+        args:
+            run: run the trial, returning None if it fails, which is not stored
+        """
+        key = self.key(hyperparameter_hash, settings)
+        if (future := self.in_flight.get(key)) is None:
+            future = asyncio.ensure_future(self._run(key, params, settings, run))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
@@ -0,0 +1,178 @@
+import json
+import logging
+import math
+import os
+from typing import Any, Literal, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerModel:
+    """A model of the time of a trial by its worker number, to choose the number
+
+    It is fitted by least squares on the telemetry of the finished trials (see
+    `cloud_train.TrainTelemetry`):
+    - the compute time of a step is linear in the batch size, and
+    - the time of a synchronization is linear in the worker number, as the
+      parameter server waits for and averages every worker.
+    With a single batch size (or worker number) seen, the time is assumed to be
+    proportional to it instead.
+
+    A trial with n workers trains 1/n of the steps on each worker, and
+    synchronizes once an epoch, so its wall-clock time is
+        steps / n * step time (batch size) + epochs * sync time (n)
+    and its cost is n times that.
+
+    The records are kept across the searches, so a trial is only predicted from
+    the records of the same model, function and data size.
+    """
+
+    def __init__(
+        self,
+        candidates: Sequence[int] = (1, 2, 4, 8),
+        *,
+        default: int = 4,
+        objective: Literal["time", "cost"] = "time",
+        path: str | None = None,
+    ) -> None:
+        """
+        args:
+            candidates: the worker numbers to choose from
+            default: the worker number before there is any telemetry
+            path: the JSON lines of the telemetry, kept across the searches
+        """
+        self.candidates = sorted(candidates)
+        self.default = default
+        self.objective = objective
+        self.path = path
+        self.records: list[dict[str, Any]] = list()
+        if path is not None and os.path.isfile(path):
+            with open(path, "r") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+            logger.info("Load %d telemetry records from %s", len(self.records), path)
+
+    def record(
+        self,
+        batch_size: int,
+        worker_number: int,
+        telemetry: dict[str, Any],
+        *,
+        model: str | None,
+        function_name: str,
+        data_size: int,
+    ) -> None:
+        """Record the telemetry of a trial, summed over its workers
+        args:
+            model: the model of the trial, None for the default of the function
+        """
+        if telemetry["steps"] == 0 or telemetry["syncs"] == 0:
+            return
+        record = {
+            "model": model,
+            "function-name": function_name,
+            "data-size": data_size,
+            "batch-size": batch_size,
+            "worker-number": worker_number,
+            "step-time": telemetry["compute_time"] / telemetry["steps"],
+            "sync-time": telemetry["sync_time"] / telemetry["syncs"],
+            "steps": telemetry["steps"],
+            "syncs": telemetry["syncs"],
+        }
+        self.records.append(record)
+        if self.path is not None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def _fit(
+        self, x_key: str, y_key: str, w_key: str, setting: dict[str, Any]
+    ) -> tuple[float, float] | None:
+        """The intercept and the slope of y by x, weighted by w
+        args:
+            setting: the fields the records must match, e.g. the model
+        """
+        records = [
+            r
+            for r in self.records
+            # the records of the other settings are not comparable
+            if all(r.get(key) == value for key, value in setting.items())
+        ]
+        if not records:
+            return None
+        x = np.asarray([r[x_key] for r in records], dtype=np.float64)
+        y = np.asarray([r[y_key] for r in records], dtype=np.float64)
+        w = np.asarray([r[w_key] for r in records], dtype=np.float64)
+        if np.unique(x).size < 2:
+            # proportional to x
+            return 0.0, float(np.average(y / x, weights=w))
+        slope, intercept = np.polyfit(x, y, 1, w=np.sqrt(w))
+        # a negative slope is noise, the time does not drop with more work
+        if slope < 0:
+            return float(np.average(y, weights=w)), 0.0
+        return float(intercept), float(slope)
+
+    def predict(
+        self,
+        worker_number: int,
+        batch_size: int,
+        data_size: int,
+        epoch: int,
+        *,
+        model: str | None,
+        function_name: str,
+    ) -> float | None:
+        """The expected wall-clock time of a trial in seconds, None if unknown"""
+        setting = {
+            "model": model,
+            "function-name": function_name,
+            "data-size": data_size,
+        }
+        step_fit = self._fit("batch-size", "step-time", "steps", setting)
+        sync_fit = self._fit("worker-number", "sync-time", "syncs", setting)
+        if step_fit is None or sync_fit is None:
+            return None
+        steps = epoch * math.ceil(data_size / worker_number / batch_size)
+        step_time = step_fit[0] + step_fit[1] * batch_size
+        sync_time = sync_fit[0] + sync_fit[1] * worker_number
+        return steps * max(step_time, 0.0) + epoch * max(sync_time, 0.0)
+
+    def choose(
+        self,
+        batch_size: int,
+        data_size: int,
+        epoch: int,
+        max_workers: int,
+        *,
+        model: str | None,
+        function_name: str,
+    ) -> int:
+        """The worker number of the least expected time or cost
+        args:
+            max_workers: the budget of the worker slots
+        """
+        candidates = [n for n in self.candidates if n <= max_workers] or [
+            min(self.default, max_workers)
+        ]
+        predictions = {
+            n: self.predict(
+                n,
+                batch_size,
+                data_size,
+                epoch,
+                model=model,
+                function_name=function_name,
+            )
+            for n in candidates
+        }
+        if any(t is None for t in predictions.values()):
+            return min(self.default, max_workers)
+
+        def objective(n: int) -> float:
+            t: float = predictions[n]  # type: ignore
+            return t if self.objective == "time" else n * t
+
+        choice = min(candidates, key=objective)
+        logger.debug("Expected time by worker number: %s", predictions)
+        return choice